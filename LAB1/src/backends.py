@@ -0,0 +1,482 @@
+#   Copyright 2020 Miljenko Šuflaj
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import asyncio
+import collections
+import multiprocessing as mp
+import queue
+import threading
+
+import numpy as np
+
+from .timer import Scheduler, Timer
+
+
+def run_blocking(coroutine):
+    #   The protocols are written as coroutines so the same code can run on an
+    #   event loop. With blocking primitives nothing is ever really awaited, so
+    #   the coroutine finishes in a single step and we don't need a loop (which
+    #   also means it works from an already running one, like in Jupyter).
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+
+    coroutine.close()
+
+    raise RuntimeError("A blocking backend can't await on an event loop!")
+
+
+def _run_target(target, args):
+    run_blocking(target(*args))
+
+
+def _run_scheduled(scheduler: Scheduler, target, args):
+    try:
+        run_blocking(target(*args))
+    finally:
+        scheduler.leave()
+
+
+# region Blocking primitives
+class _BlockingQueue:
+    def __init__(self, inner):
+        self._inner = inner
+
+    def put(self, item):
+        self._inner.put(item)
+
+    async def get(self, timeout: float = None):
+        return self._inner.get(timeout=timeout)
+
+    def qsize(self):
+        return self._inner.qsize()
+
+
+class _PipeQueue:
+    #   Unlike mp.Queue (which writes from a background thread), a put here is
+    #   done by the time it returns, so whatever is put under a lock arrives
+    #   in the same order it was put in.
+
+    def __init__(self):
+        self._reader, self._writer = mp.Pipe(duplex=False)
+        self._read_lock = mp.Lock()
+        self._write_lock = mp.Lock()
+
+    def put(self, item):
+        with self._write_lock:
+            self._writer.send(item)
+
+    async def get(self, timeout: float = None):
+        with self._read_lock:
+            if timeout is not None and not self._reader.poll(timeout):
+                raise queue.Empty
+
+            return self._reader.recv()
+
+
+class _PipeChannel:
+    def __init__(self):
+        self._receiver, self._sender = mp.Pipe(duplex=False)
+
+    def send(self, item):
+        self._sender.send(item)
+
+    async def recv(self):
+        return self._receiver.recv()
+
+
+class _QueueChannel:
+    def __init__(self):
+        self._inner = queue.SimpleQueue()
+
+    def send(self, item):
+        self._inner.put(item)
+
+    async def recv(self):
+        return self._inner.get()
+
+
+class _BlockingSemaphore:
+    def __init__(self, inner):
+        self._inner = inner
+
+    def release(self):
+        self._inner.release()
+
+    async def acquire(self):
+        self._inner.acquire()
+
+
+class _BlockingLock(_BlockingSemaphore):
+    pass
+
+
+class _SharedCounter:
+    def __init__(self, value: int = 0):
+        self._inner = mp.Value("i", value)
+
+    @property
+    def value(self):
+        return self._inner.value
+
+    def increment(self, delta: int = 1):
+        with self._inner.get_lock():
+            self._inner.value += delta
+
+
+class _LocalCounter:
+    def __init__(self, value: int = 0):
+        self._value = value
+        self._lock = threading.Lock()
+
+    @property
+    def value(self):
+        return self._value
+
+    def increment(self, delta: int = 1):
+        with self._lock:
+            self._value += delta
+# endregion
+
+
+# region Scheduled primitives
+class _ScheduledQueue:
+    #   Threads in virtual time block on the scheduler (see Scheduler), so it
+    #   knows when they're all blocked and the clock can move.
+
+    def __init__(self, scheduler: Scheduler):
+        self._scheduler = scheduler
+        self._items = collections.deque()
+
+    def put(self, item):
+        with self._scheduler.condition:
+            self._items.append(item)
+            self._scheduler.notify()
+
+    async def get(self, timeout: float = None):
+        with self._scheduler.condition:
+            if not self._scheduler.wait(lambda: len(self._items) != 0, timeout):
+                raise queue.Empty
+
+            return self._items.popleft()
+
+    def qsize(self):
+        return len(self._items)
+
+
+class _ScheduledChannel(_ScheduledQueue):
+    def send(self, item):
+        self.put(item)
+
+    async def recv(self):
+        return await self.get()
+
+
+class _ScheduledSemaphore:
+    def __init__(self, scheduler: Scheduler, value: int = 0):
+        self._scheduler = scheduler
+        self._value = value
+
+    def release(self):
+        with self._scheduler.condition:
+            self._value += 1
+            self._scheduler.notify()
+
+    async def acquire(self):
+        with self._scheduler.condition:
+            self._scheduler.wait(lambda: self._value != 0)
+            self._value -= 1
+
+
+class _ScheduledLock(_ScheduledSemaphore):
+    def __init__(self, scheduler: Scheduler):
+        super().__init__(scheduler, 1)
+# endregion
+
+
+# region Asyncio primitives
+class _AsyncQueue:
+    def __init__(self):
+        self._inner = asyncio.Queue()
+
+    def put(self, item):
+        self._inner.put_nowait(item)
+
+    async def get(self, timeout: float = None):
+        if timeout is None:
+            return await self._inner.get()
+
+        #   wait_for never returns right away, even if there's something to get.
+        if timeout <= 0:
+            try:
+                return self._inner.get_nowait()
+            except asyncio.QueueEmpty:
+                raise queue.Empty
+
+        try:
+            return await asyncio.wait_for(self._inner.get(), timeout)
+        except asyncio.TimeoutError:
+            raise queue.Empty
+
+    def qsize(self):
+        return self._inner.qsize()
+
+
+class _AsyncChannel(_AsyncQueue):
+    def send(self, item):
+        self.put(item)
+
+    async def recv(self):
+        return await self.get()
+
+
+class _AsyncSemaphore:
+    def __init__(self):
+        self._inner = asyncio.Semaphore(0)
+
+    def release(self):
+        self._inner.release()
+
+    async def acquire(self):
+        await self._inner.acquire()
+
+
+class _AsyncLock:
+    def __init__(self):
+        self._inner = asyncio.Lock()
+
+    def release(self):
+        self._inner.release()
+
+    async def acquire(self):
+        await self._inner.acquire()
+# endregion
+
+
+class Backend:
+    #   A backend decides what a worker is (a process, a thread or a task on an
+    #   event loop) and provides the primitives the workers talk through. All
+    #   of the blocking operations are awaitable, see run_blocking.
+
+    def __init__(self):
+        self._backend_id = None
+
+    @property
+    def backend_id(self):
+        return self._backend_id
+
+    def queue(self):
+        raise NotImplementedError
+
+    def strict_queue(self):
+        #   A queue that keeps the order of puts made under a lock.
+        return self.queue()
+
+    def channel(self):
+        raise NotImplementedError
+
+    def semaphore(self):
+        raise NotImplementedError
+
+    def lock(self):
+        raise NotImplementedError
+
+    def counter(self, value: int = 0):
+        return _LocalCounter(value)
+
+    def array(self, shape, dtype=np.int64):
+        return np.zeros(shape, dtype=dtype)
+
+    def spawn(self, target, args, name: str):
+        raise NotImplementedError
+
+    async def join(self, handle):
+        handle.join()
+
+    def run(self, coroutine, timer: Timer = None):
+        #   Given a (virtual) timer with a scheduler, the backend can schedule
+        #   its workers by it, see Scheduler.
+        return run_blocking(coroutine)
+
+    async def sleep(self, timer: Timer, duration: float):
+        timer.sleep(duration)
+
+    async def idle(self, timer: Timer, duration: float):
+        timer.idle(duration)
+
+
+class ProcessBackend(Backend):
+    def __init__(self):
+        super().__init__()
+
+        self._backend_id = "process"
+
+    def queue(self):
+        return _BlockingQueue(mp.Queue())
+
+    def strict_queue(self):
+        return _PipeQueue()
+
+    def channel(self):
+        return _PipeChannel()
+
+    def semaphore(self):
+        return _BlockingSemaphore(mp.Semaphore(0))
+
+    def lock(self):
+        return _BlockingLock(mp.Lock())
+
+    def counter(self, value: int = 0):
+        return _SharedCounter(value)
+
+    def array(self, shape, dtype=np.int64):
+        #   Backed by shared memory, which the (forked) workers inherit.
+        dtype = np.dtype(dtype)
+        raw = mp.RawArray("b", int(np.prod(shape)) * dtype.itemsize)
+
+        return np.frombuffer(raw, dtype=dtype).reshape(shape)
+
+    def spawn(self, target, args, name: str):
+        process = mp.Process(target=_run_target, args=(target, args), daemon=True, name=name)
+        process.start()
+
+        return process
+
+
+class ThreadBackend(Backend):
+    #   In virtual time, everything made while running is scheduled, see run.
+
+    def __init__(self):
+        super().__init__()
+
+        self._backend_id = "thread"
+        self._scheduler = None
+
+    def queue(self):
+        if self._scheduler is not None:
+            return _ScheduledQueue(self._scheduler)
+
+        return _BlockingQueue(queue.Queue())
+
+    def channel(self):
+        if self._scheduler is not None:
+            return _ScheduledChannel(self._scheduler)
+
+        return _QueueChannel()
+
+    def semaphore(self):
+        if self._scheduler is not None:
+            return _ScheduledSemaphore(self._scheduler)
+
+        return _BlockingSemaphore(threading.Semaphore(0))
+
+    def lock(self):
+        if self._scheduler is not None:
+            return _ScheduledLock(self._scheduler)
+
+        return _BlockingLock(threading.Lock())
+
+    def spawn(self, target, args, name: str):
+        if self._scheduler is None:
+            thread = threading.Thread(target=_run_target, args=(target, args), daemon=True, name=name)
+        else:
+            self._scheduler.enter()
+            thread = threading.Thread(target=_run_scheduled, args=(self._scheduler, target, args), daemon=True,
+                                      name=name)
+
+        thread.start()
+
+        return thread
+
+    async def join(self, handle):
+        if self._scheduler is not None:
+            self._scheduler.join(handle)
+
+        handle.join()
+
+    def run(self, coroutine, timer: Timer = None):
+        if timer is None or timer.scheduler is None:
+            return run_blocking(coroutine)
+
+        self._scheduler = timer.scheduler
+        self._scheduler.start()
+
+        try:
+            return run_blocking(coroutine)
+        finally:
+            self._scheduler.stop()
+            self._scheduler = None
+
+
+class AsyncioBackend(Backend):
+    #   Every worker is a task on one event loop, so a single process can host
+    #   tens of thousands of them. Unlike the other backends, this one needs
+    #   its own loop, so it can't be run from a thread that already has one.
+
+    def __init__(self):
+        super().__init__()
+
+        self._backend_id = "asyncio"
+
+    def queue(self):
+        return _AsyncQueue()
+
+    def channel(self):
+        return _AsyncChannel()
+
+    def semaphore(self):
+        return _AsyncSemaphore()
+
+    def lock(self):
+        return _AsyncLock()
+
+    def spawn(self, target, args, name: str):
+        return asyncio.get_running_loop().create_task(target(*args), name=name)
+
+    async def join(self, handle):
+        await handle
+
+    def run(self, coroutine, timer: Timer = None):
+        if timer is None or timer.scheduler is None:
+            return asyncio.run(coroutine)
+
+        return timer.scheduler.run_until_complete(coroutine)
+
+    async def sleep(self, timer: Timer, duration: float):
+        await timer.asleep(duration)
+
+    async def idle(self, timer: Timer, duration: float):
+        await timer.aidle(duration)
+
+
+name_to_backend = \
+    {
+        "process": ProcessBackend,
+        "thread": ThreadBackend,
+        "asyncio": AsyncioBackend
+    }
+
+
+def get_backend(backend: Backend or str = None):
+    if backend is None:
+        return ProcessBackend()
+
+    if isinstance(backend, Backend):
+        return backend
+
+    if backend not in name_to_backend:
+        raise ValueError(f"Backend \"{backend}\" is not a valid identifier!")
+
+    return name_to_backend[backend]()
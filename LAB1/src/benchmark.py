@@ -0,0 +1,530 @@
+#   Copyright 2020 Miljenko Šuflaj
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+#   Run from the root of the lab (where the notebook is), for example:
+#
+#       python -m src.benchmark carousel
+#
+#   All the random delays are scaled to 0 so only the synchronization is measured.
+
+import argparse
+import multiprocessing as mp
+import os
+import tempfile
+from contextlib import redirect_stdout
+from queue import PriorityQueue
+from time import perf_counter
+from typing import Dict, List
+
+import numpy as np
+
+from .carousel import Carousel, CarouselPool, VisitorPool
+from .heap import IndexedHeap
+from .philosophers import Conference, Philosopher, PhilosopherPool
+from .trace import Tracer
+from .transports import Endpoint, MeshTransport, ShmTransport, get_transport
+
+
+def print_table(rows: List[Dict]):
+    if len(rows) == 0:
+        return
+
+    columns = list(rows[0].keys())
+    cells = [[f"{x:.2f}" if isinstance(x, float) else str(x) for x in row.values()] for row in rows]
+    widths = [max(len(column), *(len(x[i]) for x in cells)) for i, column in enumerate(columns)]
+
+    print("  ".join(column.rjust(width) for column, width in zip(columns, widths)))
+
+    for row in cells:
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+
+def carousel_modes(visitor_counts=(8, 16, 32, 64), max_visitors: int = 4, modes=("queue", "dispatch"),
+                   backend: str = "process"):
+    results = list()
+
+    for mode in modes:
+        for n_visitors in visitor_counts:
+            carousel = Carousel(max_visitors=max_visitors, mode=mode, time_scale=0., backend=backend, trace="off")
+
+            start = perf_counter()
+            rides = carousel.do(n_visitors=n_visitors)
+            elapsed = perf_counter() - start
+
+            results.append({"backend": backend,
+                            "mode": mode,
+                            "visitors": n_visitors,
+                            "rides": rides,
+                            "seconds": elapsed,
+                            "rides_per_second": rides / elapsed})
+
+    return results
+
+
+def carousel_boarding(n_visitors: int = 64, max_visitors: int = 4, modes=("queue", "dispatch", "ticket"),
+                      boarding_timeout: float = None, backend: str = "thread", timer: str = "virtual",
+                      time_scale: float = 1.):
+    #   Waits are what we care about here, so the delays are kept. By default
+    #   they're simulated in virtual time, where threads and tasks run in the
+    #   same order they would in real time (see Scheduler), only without
+    #   waiting. The percentiles are as fine as the buckets of the histogram,
+    #   and they vary from run to run, same as the random delays.
+    results = list()
+
+    for mode in modes:
+        carousel = Carousel(max_visitors=max_visitors, mode=mode, time_scale=time_scale, timer=timer, backend=backend,
+                            boarding_timeout=None if mode == "queue" else boarding_timeout, trace="off")
+        rides = carousel.do(n_visitors=n_visitors)
+        snapshot = carousel.metrics.snapshot(full=False)
+
+        results.append({"mode": mode,
+                        "visitors": n_visitors,
+                        "rides": rides,
+                        "mean_occupancy": snapshot["occupancy"]["mean"],
+                        "wait_p50": snapshot["wait"]["p50"],
+                        "wait_p99": snapshot["wait"]["p99"]})
+
+    return results
+
+
+def carousel_pool(carousel_counts=(1, 2, 4), n_visitors: int = 64, max_visitors: int = 4, time_scale: float = 0.01):
+    #   Unlike the other benchmarks, rides take some (scaled) time here, since
+    #   running them in parallel is exactly what we want to measure.
+    results = list()
+
+    for n_carousels in carousel_counts:
+        pool = CarouselPool(n_carousels=n_carousels, max_visitors=max_visitors, time_scale=time_scale, trace="off")
+
+        start = perf_counter()
+        rides = pool.do(n_visitors=n_visitors)
+        elapsed = perf_counter() - start
+
+        results.append({"carousels": n_carousels,
+                        "visitors": n_visitors,
+                        "rides": rides,
+                        "seconds": elapsed,
+                        "rides_per_second": rides / elapsed,
+                        "mean_occupancy": pool.metrics.snapshot(full=False)["occupancy"]["mean"]})
+
+    return results
+
+
+def conference_transports(philosopher_counts=(10, 50, 200), transports=("mesh", "hub", "shm"), timer: str = "virtual"):
+    #   In virtual time, this measures how long the messaging itself takes. In
+    #   real time, the time to table shows how long philosophers wait on each
+    #   other (the random delays are kept). The mesh is capped at 10 philosophers,
+    #   so it's only run up to that.
+    results = list()
+
+    for transport in transports:
+        for n_philosophers in philosopher_counts:
+            if transport == "mesh" and n_philosophers > 10:
+                continue
+
+            conference = Conference(n_philosophers, timer=timer, transport=transport, trace="off")
+
+            start = perf_counter()
+            conference.start()
+            elapsed = perf_counter() - start
+
+            results.append({"transport": transport,
+                            "philosophers": n_philosophers,
+                            "seconds": elapsed,
+                            "timer_seconds": conference.elapsed,
+                            "time_to_table": sum(conference.time_to_table) / len(conference.time_to_table)})
+
+    return results
+
+
+def conference_protocols(philosopher_counts=(5, 10, 20, 50), protocols=("lamport", "ricart-agrawala"),
+                         transport: str = "hub", timer: str = "virtual"):
+    results = list()
+
+    for protocol in protocols:
+        for n_philosophers in philosopher_counts:
+            conference = Conference(n_philosophers, timer=timer, transport=transport, protocol=protocol, trace="off")
+
+            start = perf_counter()
+            conference.start()
+            elapsed = perf_counter() - start
+
+            results.append({"protocol": protocol,
+                            "philosophers": n_philosophers,
+                            "messages": conference.messages,
+                            "messages_per_entry": conference.messages_per_entry,
+                            "time_to_table": sum(conference.time_to_table) / len(conference.time_to_table),
+                            "seconds": elapsed})
+
+    return results
+
+
+def conference_throughput(n_philosophers: int = 10, rounds: int = 100, protocols=("lamport", "ricart-agrawala"),
+                          transports=("mesh", "hub", "shm")):
+    #   All the delays are scaled to 0, so philosophers ask for the table again
+    #   as soon as they leave it, and the table is never free for long.
+    results = list()
+
+    for protocol in protocols:
+        for transport in transports:
+            conference = Conference(n_philosophers, transport=transport, protocol=protocol, rounds=rounds,
+                                    time_scale=0., trace="off")
+            conference.start()
+
+            results.append({"protocol": protocol,
+                            "transport": transport,
+                            "philosophers": n_philosophers,
+                            "entries": len(conference.entries),
+                            "entries_per_second": conference.entries_per_second,
+                            "sync_delay_us": conference.synchronization_delay * 1e6,
+                            "messages_per_entry": conference.messages_per_entry})
+
+    return results
+
+
+def conference_seats(n_philosophers: int = 10, rounds: int = 20, seat_counts=(1, 2, 3, 5), transport: str = "hub",
+                     time_scale: float = 0.01):
+    #   Unlike with throughput, philosophers stay at the table for a while, so
+    #   it's the table, and not the messages, that everyone waits on.
+    results = list()
+
+    for seats in seat_counts:
+        conference = Conference(n_philosophers, transport=transport, rounds=rounds, time_scale=time_scale,
+                                seats=seats, trace="off")
+        conference.start()
+
+        results.append({"seats": seats,
+                        "philosophers": n_philosophers,
+                        "entries": len(conference.entries),
+                        "occupancy": conference.occupancy,
+                        "entries_per_second": conference.entries_per_second,
+                        "time_to_table": sum(conference.time_to_table) / len(conference.time_to_table),
+                        "sync_delay_us": conference.synchronization_delay * 1e6})
+
+    return results
+
+
+def conference_tracing(n_philosophers: int = 10, rounds: int = 100, transport: str = "hub"):
+    #   Same as throughput, but with every message traced: printed (to nowhere,
+    #   so the terminal doesn't slow it down), or recorded into ring buffers.
+    results = list()
+
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull, "w") as devnull:
+        for sink, trace in (("off", "off"), ("print", None), ("ring", Tracer(directory=directory))):
+            conference = Conference(n_philosophers, transport=transport, rounds=rounds, time_scale=0., trace=trace)
+
+            with redirect_stdout(devnull):
+                conference.start()
+
+            results.append({"trace": sink,
+                            "philosophers": n_philosophers,
+                            "entries": len(conference.entries),
+                            "entries_per_second": conference.entries_per_second,
+                            "messages": conference.messages})
+
+    return results
+
+
+def worker_reuse(n_workers: int = 10, runs: int = 20, transport: str = "hub"):
+    #   Short runs (a single round, with every delay scaled to 0), so most of
+    #   the time goes into getting the workers started, either by forking them
+    #   for every run, or once, in a pool. Making the pool is timed as well.
+    results = list()
+
+    for workload in ("conference", "carousel"):
+        for reuse in (False, True):
+            start = perf_counter()
+            pool = None
+
+            if reuse:
+                pool = PhilosopherPool(n_workers, transport) if workload == "conference" else VisitorPool(n_workers)
+
+            spawned = perf_counter()
+
+            for _ in range(runs):
+                if workload == "conference":
+                    Conference(n_workers, transport=transport, time_scale=0., trace="off", pool=pool).start()
+                else:
+                    Carousel(max_visitors=4, mode="dispatch", time_scale=0., trace="off", pool=pool).do(n_workers)
+
+            elapsed = perf_counter() - spawned
+
+            if pool is not None:
+                pool.close()
+
+            results.append({"workload": workload,
+                            "workers": n_workers,
+                            "pool": reuse,
+                            "spawn_ms": (spawned - start) * 1e3,
+                            "ms_per_run": elapsed / runs * 1e3})
+
+    return results
+
+
+def philosopher_queue(sizes=(100, 500, 1000), repeats: int = 10):
+    #   A queue of outstanding requests, every one of which then exits, in a
+    #   random order. The priority queue can only take exits off the front,
+    #   so it has to remember the others until they get there (like the
+    #   philosophers used to), while the indexed heap removes them right away.
+    results = list()
+    generator = np.random.default_rng(0)
+
+    for size in sizes:
+        requests = [(int(clock), 0, i) for i, clock in enumerate(generator.permutation(size))]
+        exits = [int(i) for i in generator.permutation(size)]
+
+        start = perf_counter()
+
+        for _ in range(repeats):
+            queue = PriorityQueue()
+            exited = set()
+
+            for request in requests:
+                queue.put(request)
+
+            for identifier in exits:
+                exited.add(identifier)
+
+                while queue.qsize() != 0 and queue.queue[0][2] in exited:
+                    exited.remove(queue.get()[2])
+
+        priority_queue = perf_counter() - start
+        start = perf_counter()
+
+        for _ in range(repeats):
+            heap = IndexedHeap()
+
+            for request in requests:
+                heap.push(request[2], request)
+
+            for identifier in exits:
+                heap.remove(identifier)
+
+        indexed_heap = perf_counter() - start
+
+        results.append({"requests": size,
+                        "priority_queue_us": priority_queue / (repeats * size) * 1e6,
+                        "indexed_heap_us": indexed_heap / (repeats * size) * 1e6})
+
+    return results
+
+
+def _echo(endpoint: Endpoint, n_messages: int):
+    for _ in range(n_messages):
+        source, message = endpoint.receive()
+        endpoint.send(bytes(message), source)
+        endpoint.flush()
+
+
+def transport_latency(transports=("mesh", "tcp"), n_messages: int = 10000, batch: int = 100):
+    #   Two philosophers (processes) on each transport: one sends messages and
+    #   the other sends them back. The round trip is timed for a single message
+    #   at a time, and throughput for batch messages in flight at once.
+    results = list()
+
+    for transport_name in transports:
+        #   A ring has to fit every message in flight, see ShmTransport.
+        transport = ShmTransport(slots=batch) if transport_name == "shm" else get_transport(transport_name)
+        sender, receiver = transport.open(2)
+        echo = mp.Process(target=_echo, args=(receiver, 2 * n_messages), daemon=True)
+        echo.start()
+
+        message = Philosopher.get_message(0, 0, 0, 0.)
+        start = perf_counter()
+
+        for _ in range(n_messages):
+            sender.send(message, 1)
+            sender.receive()
+
+        round_trip = (perf_counter() - start) / n_messages
+        start = perf_counter()
+
+        for i in range(0, n_messages, batch):
+            for _ in range(i, min(i + batch, n_messages)):
+                sender.send(message, 1)
+
+            sender.flush()
+
+            for _ in range(i, min(i + batch, n_messages)):
+                sender.receive()
+
+        elapsed = perf_counter() - start
+
+        echo.join()
+        transport.close()
+
+        results.append({"transport": transport_name,
+                        "round_trip_us": round_trip * 1e6,
+                        "messages_per_second": n_messages / elapsed})
+
+    return results
+
+
+def philosopher_framing(n_messages: int = 100000, batch: int = 10):
+    #   One philosopher sending messages to another through a pipe, in the same
+    #   process. The text format is the original one: a line per message,
+    #   written by itself and parsed back with split.
+    results = list()
+
+    reader, writer = os.pipe()
+
+    with os.fdopen(reader, "rb") as lines:
+        start = perf_counter()
+
+        for i in range(0, n_messages, batch):
+            for j in range(i, i + batch):
+                os.write(writer, bytes(f"0\t{j % 10}\t{j}\t{float(j)!r}\n", encoding="utf8"))
+
+            for _ in range(batch):
+                *fields, stamp = str(lines.readline(), encoding="utf8").strip().split("\t")
+                [int(x) for x in fields] + [float(stamp)]
+
+        elapsed = perf_counter() - start
+
+    os.close(writer)
+    results.append({"format": "text", "messages": n_messages, "seconds": elapsed,
+                    "messages_per_second": n_messages / elapsed})
+
+    transport = MeshTransport()
+    sender, receiver = transport.open(2)
+
+    start = perf_counter()
+
+    for i in range(0, n_messages, batch):
+        for j in range(i, i + batch):
+            sender.send(Philosopher.get_message(0, j % 10, j, float(j)), 1)
+
+        sender.flush()
+
+        for _ in range(batch):
+            Philosopher.get_message_tuple(receiver.receive()[1])
+
+    elapsed = perf_counter() - start
+
+    transport.close()
+    results.append({"format": "binary", "messages": n_messages, "seconds": elapsed,
+                    "messages_per_second": n_messages / elapsed})
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NOS LAB1 benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    carousel_parser = subparsers.add_parser("carousel", help="rides per second, queue vs dispatch")
+    carousel_parser.add_argument("--visitors", type=int, nargs="+", default=[8, 16, 32, 64])
+    carousel_parser.add_argument("--seats", type=int, default=4)
+    carousel_parser.add_argument("--modes", nargs="+", default=["queue", "dispatch"])
+    carousel_parser.add_argument("--backend", choices=["process", "thread", "asyncio"], default="process")
+
+    boarding_parser = subparsers.add_parser("boarding", help="p50/p99 wait (in timer seconds) of every mode")
+    boarding_parser.add_argument("--visitors", type=int, default=64)
+    boarding_parser.add_argument("--seats", type=int, default=4)
+    boarding_parser.add_argument("--modes", nargs="+", default=["queue", "dispatch", "ticket"])
+    boarding_parser.add_argument("--boarding-timeout", type=float, default=None)
+    boarding_parser.add_argument("--backend", choices=["process", "thread", "asyncio"], default="thread")
+    boarding_parser.add_argument("--timer", choices=["real", "virtual"], default="virtual")
+    boarding_parser.add_argument("--time-scale", type=float, default=1.)
+
+    pool_parser = subparsers.add_parser("pool", help="rides per second as carousels are added")
+    pool_parser.add_argument("--carousels", type=int, nargs="+", default=[1, 2, 4])
+    pool_parser.add_argument("--visitors", type=int, default=64)
+    pool_parser.add_argument("--seats", type=int, default=4)
+    pool_parser.add_argument("--time-scale", type=float, default=0.01)
+
+    conference_parser = subparsers.add_parser("conference", help="duration of a conference with each transport")
+    conference_parser.add_argument("--philosophers", type=int, nargs="+", default=[10, 50, 200])
+    conference_parser.add_argument("--transports", nargs="+", default=["mesh", "hub", "shm"])
+    conference_parser.add_argument("--timer", choices=["real", "virtual"], default="virtual")
+
+    protocols_parser = subparsers.add_parser("protocols", help="messages and time to table of each protocol")
+    protocols_parser.add_argument("--philosophers", type=int, nargs="+", default=[5, 10, 20, 50])
+    protocols_parser.add_argument("--protocols", nargs="+", default=["lamport", "ricart-agrawala"])
+    protocols_parser.add_argument("--transport", choices=["mesh", "hub", "shm"], default="hub")
+    protocols_parser.add_argument("--timer", choices=["real", "virtual"], default="virtual")
+
+    throughput_parser = subparsers.add_parser("throughput", help="table entries per second over many rounds")
+    throughput_parser.add_argument("--philosophers", type=int, default=10)
+    throughput_parser.add_argument("--rounds", type=int, default=100)
+    throughput_parser.add_argument("--protocols", nargs="+", default=["lamport", "ricart-agrawala"])
+    throughput_parser.add_argument("--transports", nargs="+", default=["mesh", "hub", "shm"])
+
+    seats_parser = subparsers.add_parser("seats", help="table entries per second as seats are added")
+    seats_parser.add_argument("--philosophers", type=int, default=10)
+    seats_parser.add_argument("--rounds", type=int, default=20)
+    seats_parser.add_argument("--seats", type=int, nargs="+", default=[1, 2, 3, 5])
+    seats_parser.add_argument("--transport", choices=["mesh", "hub", "shm"], default="hub")
+    seats_parser.add_argument("--time-scale", type=float, default=0.01)
+
+    trace_parser = subparsers.add_parser("trace", help="table entries per second, printing vs recording every message")
+    trace_parser.add_argument("--philosophers", type=int, default=10)
+    trace_parser.add_argument("--rounds", type=int, default=100)
+    trace_parser.add_argument("--transport", choices=["mesh", "hub", "shm"], default="hub")
+
+    reuse_parser = subparsers.add_parser("reuse", help="duration of short runs, forking workers vs a worker pool")
+    reuse_parser.add_argument("--workers", type=int, default=10)
+    reuse_parser.add_argument("--runs", type=int, default=20)
+    reuse_parser.add_argument("--transport", choices=["mesh", "hub", "shm", "tcp"], default="hub")
+
+    queue_parser = subparsers.add_parser("queue", help="request queue operations, priority queue vs indexed heap")
+    queue_parser.add_argument("--sizes", type=int, nargs="+", default=[100, 500, 1000])
+    queue_parser.add_argument("--repeats", type=int, default=10)
+
+    transports_parser = subparsers.add_parser("transports", help="round trip and messages per second of a transport")
+    transports_parser.add_argument("--transports", nargs="+", default=["mesh", "tcp"])
+    transports_parser.add_argument("--messages", type=int, default=10000)
+    transports_parser.add_argument("--batch", type=int, default=100)
+
+    framing_parser = subparsers.add_parser("framing", help="philosopher messages per second, text vs binary")
+    framing_parser.add_argument("--messages", type=int, default=100000)
+    framing_parser.add_argument("--batch", type=int, default=10)
+
+    args = parser.parse_args()
+
+    if args.benchmark == "carousel":
+        print_table(carousel_modes(visitor_counts=args.visitors, max_visitors=args.seats, modes=args.modes,
+                                   backend=args.backend))
+    elif args.benchmark == "boarding":
+        print_table(carousel_boarding(n_visitors=args.visitors, max_visitors=args.seats, modes=args.modes,
+                                      boarding_timeout=args.boarding_timeout, backend=args.backend, timer=args.timer,
+                                      time_scale=args.time_scale))
+    elif args.benchmark == "pool":
+        print_table(carousel_pool(carousel_counts=args.carousels, n_visitors=args.visitors, max_visitors=args.seats,
+                                  time_scale=args.time_scale))
+    elif args.benchmark == "conference":
+        print_table(conference_transports(philosopher_counts=args.philosophers, transports=args.transports,
+                                          timer=args.timer))
+    elif args.benchmark == "protocols":
+        print_table(conference_protocols(philosopher_counts=args.philosophers, protocols=args.protocols,
+                                         transport=args.transport, timer=args.timer))
+    elif args.benchmark == "throughput":
+        print_table(conference_throughput(n_philosophers=args.philosophers, rounds=args.rounds,
+                                          protocols=args.protocols, transports=args.transports))
+    elif args.benchmark == "seats":
+        print_table(conference_seats(n_philosophers=args.philosophers, rounds=args.rounds, seat_counts=args.seats,
+                                     transport=args.transport, time_scale=args.time_scale))
+    elif args.benchmark == "trace":
+        print_table(conference_tracing(n_philosophers=args.philosophers, rounds=args.rounds, transport=args.transport))
+    elif args.benchmark == "reuse":
+        print_table(worker_reuse(n_workers=args.workers, runs=args.runs, transport=args.transport))
+    elif args.benchmark == "queue":
+        print_table(philosopher_queue(sizes=args.sizes, repeats=args.repeats))
+    elif args.benchmark == "transports":
+        print_table(transport_latency(transports=args.transports, n_messages=args.messages, batch=args.batch))
+    elif args.benchmark == "framing":
+        print_table(philosopher_framing(n_messages=args.messages, batch=args.batch))
+
+
+if __name__ == "__main__":
+    main()
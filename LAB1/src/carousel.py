@@ -14,21 +14,42 @@
 
 
 import multiprocessing as mp
-from time import sleep
+import queue
 from typing import List
 
 import numpy as np
 
+from .backends import Backend, ProcessBackend, get_backend
+from .metrics import CarouselMetrics, Histogram
+from .pool import WorkerPool
+from .timer import Timer, get_timer
+from .trace import CAROUSEL_DONE, CAROUSEL_STARTED, CAROUSEL_STOPPED, INFO, POOL_DONE, VISITOR_DONE, VISITOR_LEFT, \
+    VISITOR_SEATED, Tracer, get_tracer
+
 
 class Visitor:
-    def __init__(self, name: str):
+    def __init__(self, name: str, rides: int = None, time_scale: float = None, timer: Timer = None,
+                 trace: Tracer or str = None):
         #   I know that the identifier property can be done with simple
         #   integers, but my thinking was to allow string identifiers
         #   from the get go, irrespective of what I'd end up using.
 
         self._name = "visitor" if name is None else name
         self._process = None
+        self._backend = None
+
+        #   The number 3 is task specific; it's arbitrary otherwise.
+        self._rides = 3 if rides is None else rides
+        self._time_scale = 1. if time_scale is None else time_scale
+        self._timer = get_timer(timer).copy()
+        self._trace = get_tracer(trace)
+        self._source = bytes(self._name, encoding="utf8")
 
+        #   Every visitor has its own generator, otherwise the forked processes
+        #   would all inherit the same state and sleep for the same durations.
+        self._random = np.random.default_rng()
+
+    # region Properties
     @property
     def name(self):
         return self._name
@@ -37,56 +58,324 @@ class Visitor:
     def process(self):
         return self._process
 
-    def start(self, in_q: mp.Queue, out_q: mp.Queue):
-        self._process = mp.Process(target=self._do,
-                                   args=(in_q, out_q),
-                                   daemon=True,
-                                   name=self.name)
-        self._process.start()
+    @property
+    def backend(self):
+        return self._backend
 
-    def _do(self, in_q: mp.Queue, out_q: mp.Queue):
-        #   The number 3 is task specific; it's arbitrary otherwise.
-        for _ in range(3):
-            sleep(np.random.uniform(0.1, 2.))
-            out_q.put("Želim se voziti")
+    @property
+    def rides(self):
+        return self._rides
+
+    @property
+    def time_scale(self):
+        return self._time_scale
+
+    @property
+    def timer(self):
+        return self._timer
+
+    @property
+    def trace(self):
+        return self._trace
+    # endregion
+
+    def _spawn(self, backend: Backend, target, args):
+        self._backend = backend
+        self._process = backend.spawn(target=target, args=args, name=self.name)
+
+    def _record(self, event: int):
+        self.trace.record(INFO, event, self._source, time=self.timer.now())
+
+    def start(self, backend: Backend, in_q, out_q, finished, waits: Histogram):
+        self._spawn(backend, target=self._do, args=(in_q, out_q, finished, waits))
+
+    def start_dispatched(self, backend: Backend, demand, waits: Histogram):
+        self._spawn(backend, target=self._dispatched_do, args=(demand, waits))
+
+    def visit(self, backend: Backend, demand, waits: Histogram):
+        #   Same as start_dispatched, only in the calling process (see VisitorPool).
+        self._backend = backend
+        backend.run(self._dispatched_do(demand, waits))
+
+    async def _wait(self):
+        await self.backend.sleep(self.timer, self._random.uniform(0.1, 2.) * self.time_scale)
+
+    async def _do(self, in_q, out_q, finished, waits: Histogram):
+        for ride in range(self.rides):
+            await self._wait()
+
+            requested = self.timer.stamp()
+            out_q.put(("Želim se voziti", requested))
 
             while True:
-                message = in_q.get()
+                message = await in_q.get()
 
-                if message != "Sjedi":
+                if message[0] != "Sjedi":
                     in_q.put(message)
+
+                    #   Threads and processes get preempted, but on an event loop
+                    #   we have to step aside ourselves for someone else to take it.
+                    await self.backend.idle(self.timer, 0.)
                 else:
+                    self.timer.observe(message[1])
                     break
 
-            print(f"Sjeo posjetitelj {self.name}\n", end="")
+            waits.record(self.timer.now() - requested)
+            self._record(VISITOR_SEATED)
+
+            #   We announce that we're done before taking "Ustani" off the queue, so
+            #   once the carousel sees all of them taken, it also sees us as done.
+            #   Checking the exit code instead races with the process shutting down.
+            if ride == self.rides - 1:
+                finished.increment()
 
             while True:
-                message = in_q.get()
+                message = await in_q.get()
 
-                if message != "Ustani":
+                if message[0] != "Ustani":
                     in_q.put(message)
                 else:
+                    self.timer.observe(message[1])
                     break
 
                 #   This is optional, I like to sleep inactive threads in
                 #   an infinite loop to give others some breathing room.
-                sleep(0.05)
+                await self.backend.idle(self.timer, 0.05)
+
+            self._record(VISITOR_LEFT)
+
+        self._record(VISITOR_DONE)
+        self.trace.flush()
+
+    async def _request(self, demand, stamp: float):
+        if demand.tickets is None:
+            demand.requests.put(("Želim se voziti", self.name, stamp, None))
+            return
+
+        #   Drawing a ticket and queueing up is one step, so the requests come
+        #   out of the (strictly ordered) queue in the order of their tickets.
+        await demand.ticket_lock.acquire()
+
+        ticket = demand.tickets.value
+        demand.tickets.increment()
+        demand.requests.put(("Želim se voziti", self.name, stamp, ticket))
+
+        demand.ticket_lock.release()
+
+    async def _dispatched_do(self, demand, waits: Histogram):
+        #   Here the carousel addresses us directly through our own channel, so
+        #   nobody has to sift through (and put back) messages meant for others.
+        #   Every transition is acknowledged through the semaphore of the carousel
+        #   that seated us (there can be more than one, see CarouselPool), which
+        #   it acquires once per seated visitor.
+
+        channel = demand.channels[self.name]
+        done = demand.done
+
+        for _ in range(self.rides):
+            await self._wait()
+
+            requested = self.timer.stamp()
+            await self._request(demand, requested)
+
+            message, carousel, stamp = await channel.recv()
+
+            if message != "Sjedi":
+                break
+
+            self.timer.observe(stamp)
+            waits.record(self.timer.now() - requested)
+            self._record(VISITOR_SEATED)
+            done[carousel].release()
+
+            self.timer.observe((await channel.recv())[2])
+
+            self._record(VISITOR_LEFT)
+            done[carousel].release()
+
+        self._record(VISITOR_DONE)
+        self.trace.flush()
+
+
+class Demand:
+    #   Everything the carousels drawing from the same visitors share: the queue
+    #   of requests, a channel to every visitor, and how many rides everyone
+    #   has left. Carousels fill up one at a time (under the lock), so two of
+    #   them can't end up each holding half of the visitors they need.
+    #
+    #   When ticketed, visitors also draw a ticket as they queue up, and the
+    #   queue keeps the order they did it in.
+    #
+    #   A reusable demand serves any number of runs (see VisitorPool), so its
+    #   queues are strict ones: whatever is left in them after a run can then
+    #   be drained for sure, since every put is done by the time it returns.
+
+    def __init__(self, backend: Backend, workers: List[Visitor], carousels: int = 1, ticketed: bool = False,
+                 reusable: bool = False):
+        self.requests = backend.strict_queue() if ticketed or reusable else backend.queue()
+        self.held = backend.strict_queue()
+        self.tickets = backend.counter() if ticketed else None
+        self.ticket_lock = backend.lock() if ticketed else None
+        self.channels = {worker.name: backend.channel() for worker in workers}
+        self.done = [backend.semaphore() for _ in range(carousels)]
+        self.lock = backend.lock()
+
+        self.index = {worker.name: i for i, worker in enumerate(workers)}
+        self.rides_left = backend.array(len(workers), dtype=np.int32)
+        self.rides_left[:] = [worker.rides for worker in workers]
+        self.active = backend.counter(sum(1 for worker in workers if worker.rides != 0))
+
+        self.carousels = carousels
+
+    async def reset(self, workers: List[Visitor]):
+        #   A run can leave nudges nobody took, and requests of visitors that
+        #   were sent home. Everything else is used up by the end of it.
+        for requests in (self.requests, self.held):
+            while True:
+                try:
+                    await requests.get(timeout=0.)
+                except queue.Empty:
+                    break
+
+        self.rides_left[:] = [worker.rides for worker in workers]
+        self.active.increment(sum(1 for worker in workers if worker.rides != 0) - self.active.value)
 
-            print(f"Sišao posjetitelj {self.name}\n", end="")
+    def close(self):
+        #   Wakes up whoever is waiting for requests that will never come.
+        for _ in range(self.carousels):
+            self.nudge()
 
-        print(f"\nPosjetitelj {self.name} završio.\n", end="")
+    def hold(self, request):
+        #   A request that came in too late for the last ride is first in line
+        #   for the next one, no matter which carousel fills up next.
+        self.held.put(request)
+
+    def nudge(self):
+        #   A None makes whoever is filling up look at who's still active again.
+        self.requests.put(None)
+
+    def dismiss(self, stamp: float):
+        #   Whoever is left can't fill a carousel anymore, so we send them home
+        #   instead of leaving them blocked on their channels.
+        for name, i in self.index.items():
+            if self.rides_left[i] != 0:
+                self.channels[name].send(("Zatvoreno", None, stamp))
+
+
+class VisitorPool(WorkerPool):
+    #   A process for every visitor, along with everything they share with the
+    #   carousel, made once and then reused by any number of carousels (see
+    #   Carousel). Every carousel gets new visitors, but they run in the same
+    #   processes and are seated through the same channels, which are reset
+    #   in between.
+
+    def __init__(self, n_visitors: int = None, mode: str = None):
+        mode = "dispatch" if mode is None else mode
+
+        if mode not in ("dispatch", "ticket"):
+            raise ValueError(f"Mode \"{mode}\" is not a valid identifier!")
+
+        n_visitors = 8 if n_visitors is None else n_visitors
+
+        self._mode = mode
+        self._backend = ProcessBackend()
+        self._demand = Demand(self._backend, [Visitor(f"{i}", trace="off") for i in range(n_visitors)],
+                              ticketed=mode == "ticket", reusable=True)
+        self._waits = self._backend.array((n_visitors, Histogram.size))
+
+        super().__init__([(self._backend, self._demand, self._waits)] * n_visitors, name="visitor")
+
+    # region Properties
+    @property
+    def mode(self):
+        return self._mode
+
+    @property
+    def backend(self):
+        return self._backend
+
+    @property
+    def demand(self):
+        return self._demand
+
+    @property
+    def waits(self):
+        return self._waits
+    # endregion
+
+    @staticmethod
+    def _visit(resource, visitor: Visitor, index: int):
+        backend, demand, waits = resource
+        visitor.visit(backend, demand, Histogram(waits[index]))
 
 
 class Carousel:
-    def __init__(self, max_visitors=None):
-        self._max_visitors = 4 if max_visitors is None else max_visitors
+    __modes = {"queue", "dispatch", "ticket"}
+
+    def __init__(self, max_visitors=None, mode: str = None, time_scale: float = None, timer: Timer or str = None,
+                 backend: Backend or str = None, sample_interval: float = None, boarding_timeout: float = None,
+                 name: str = None, trace: Tracer or str = None, pool: VisitorPool = None):
+        #   There are three modes of operation:
+        #       - queue: the original solution, everyone shares one queue of messages
+        #       - dispatch: the carousel signals the chosen visitors directly
+        #       - ticket: same as dispatch, but visitors are seated strictly in
+        #         the order they asked for a ride, so nobody can be overtaken
+        #
+        #   Visitors are processes by default, but they can also be threads or
+        #   asyncio tasks (see backends.py), in all modes.
+        #
+        #   Metrics are always collected (see metrics.py) and can be sampled every
+        #   sample_interval seconds (of timer time), checked at the end of a ride.
+        #
+        #   Without a boarding_timeout, the carousel only ever runs full, and stops
+        #   once there aren't enough visitors left to fill it. With one, it leaves
+        #   with whoever boarded once that many seconds (scaled, same as all the
+        #   other delays) pass since the first of them did, and it keeps going
+        #   until nobody is left. Not available in queue mode.
+        #
+        #   The carousel and its visitors record what they do through trace (see
+        #   trace.py), which by default prints everything as it happens.
+        #
+        #   With a pool, visitors run in its processes, which saves forking them
+        #   for every run, so their number, the mode and the backend are the pool's.
+
+        if pool is not None:
+            if mode is not None and mode != pool.mode:
+                raise ValueError(f"Mode \"{mode}\" doesn't match the pool's mode \"{pool.mode}\"!")
+
+            mode = pool.mode
+            backend = pool.backend
+
+        mode = "queue" if mode is None else mode
+
+        if mode not in self.__modes:
+            raise ValueError(f"Mode \"{mode}\" is not a valid identifier!")
+
+        if mode == "queue" and boarding_timeout is not None:
+            raise ValueError(f"Mode \"{mode}\" doesn't support partial rides!")
 
-        self._in_q = mp.Queue()
-        self._out_q = mp.Queue()
+        self._max_visitors = 4 if max_visitors is None else max_visitors
+        self._name = "vrtuljak" if name is None else name
+        self._mode = mode
+        self._time_scale = 1. if time_scale is None else time_scale
+        self._timer = get_timer(timer)
+        self._backend = get_backend(backend)
+        self._sample_interval = sample_interval
+        self._last_sample = None
+        self._boarding_timeout = boarding_timeout
+        self._trace = get_tracer(trace)
+        self._pool = pool
+        self._elapsed = None
+        self._metrics = None
+
+        #   The queues belong to the backend, so they are made once we start.
+        self._in_q = None
+        self._out_q = None
 
         self._process = None
         self._workers: List[Visitor] = list()
 
+    # region Properties
     @property
     def in_q(self):
         return self._in_q
@@ -99,40 +388,411 @@ class Carousel:
     def max_visitors(self):
         return self._max_visitors
 
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @property
+    def time_scale(self):
+        return self._time_scale
+
+    @property
+    def timer(self):
+        return self._timer
+
+    @property
+    def backend(self):
+        return self._backend
+
+    @property
+    def boarding_timeout(self):
+        return self._boarding_timeout
+
+    @property
+    def min_visitors(self):
+        return self.max_visitors if self.boarding_timeout is None else 1
+
+    @property
+    def trace(self):
+        return self._trace
+
+    @property
+    def pool(self):
+        return self._pool
+
+    @property
+    def elapsed(self):
+        return self._elapsed
+
+    @property
+    def metrics(self):
+        return self._metrics
+    # endregion
+
+    def _record(self, event: int):
+        self.trace.record(INFO, event, bytes(self.name, encoding="utf8"), time=self.timer.now())
+
+    async def _ride(self):
+        self._record(CAROUSEL_STARTED)
+        await self.backend.sleep(self.timer, np.random.uniform(1., 3.) * self.time_scale)
+        self._record(CAROUSEL_STOPPED)
+
+        # Add this to make input more deterministic
+        await self.backend.sleep(self.timer, 0.25 * self.time_scale)
+
     def do(self, n_visitors=None):
+        start = self.timer.now()
+
+        if self.pool is not None:
+            n_visitors = self.pool.size
+
         for i in range(8 if n_visitors is None else n_visitors):
-            self._workers.append(Visitor(f"{i}"))
+            self._workers.append(Visitor(f"{i}", time_scale=self.time_scale, timer=self.timer, trace=self.trace))
 
-        for worker in self._workers:
-            worker.start(self.out_q, self.in_q)
+        rides = self.backend.run(self._do(), self.timer)
+
+        self._elapsed = self.timer.now() - start
+        self._record(CAROUSEL_DONE)
+        self.trace.flush()
+
+        return rides
+
+    def _start_metrics(self, workers: List[Visitor], waits, carousels: int = 1):
+        #   Every ride has at least one visitor, so this is as many as there can be.
+        self._metrics = CarouselMetrics(waits=waits,
+                                        names=[worker.name for worker in workers],
+                                        seats=self.max_visitors,
+                                        max_rides=sum(worker.rides for worker in workers),
+                                        carousels=carousels)
+        self._metrics.start(self.timer.now())
+        self._last_sample = self.timer.now()
+
+        return self._metrics
+
+    async def _do(self):
+        if self.pool is not None:
+            self.pool.waits[:] = 0
+            self._start_metrics(self._workers, self.pool.waits)
+        else:
+            self._start_metrics(self._workers, self.backend.array((len(self._workers), Histogram.size)))
+
+        if self.mode in ("dispatch", "ticket"):
+            rides = await self._dispatched_do()
+        else:
+            rides = await self._queued_do()
+
+        self._metrics.stop(self.timer.now())
+
+        return rides
+
+    def _record_ride(self, riders: int):
+        now = self.timer.now()
+        self._metrics.add_ride(riders, now)
+
+        if self._sample_interval is not None and now - self._last_sample >= self._sample_interval:
+            self._metrics.sample()
+            self._last_sample = now
 
-        non_zero_count = self.max_visitors
+    async def _queued_do(self):
+        self._in_q = self.backend.queue()
+        self._out_q = self.backend.queue()
+
+        finished = self.backend.counter()
+
+        for i, worker in enumerate(self._workers):
+            worker.start(self.backend, self.out_q, self.in_q, finished, self.metrics.histogram(i))
+
+        rides = 0
+        non_zero_count = len(self._workers)
 
         while non_zero_count >= self.max_visitors:
-            while self.in_q.get() != "Želim se voziti" and non_zero_count != 0:
-                sleep(0.05)
+            idle_start = self.timer.now()
+
+            while True:
+                message = await self.in_q.get()
+                self.timer.observe(message[1])
+
+                if message[0] == "Želim se voziti" or non_zero_count == 0:
+                    break
+
+                await self.backend.idle(self.timer, 0.05)
+
+            self.metrics.add_idle(self.timer.now() - idle_start)
 
             for _ in range(self.max_visitors):
-                self.out_q.put("Sjedi")
+                self.out_q.put(("Sjedi", self.timer.stamp()))
 
             # Not necessary, but makes sure you wait for everyone to get on the carousel.
             while self.out_q.qsize() != 0:
-                sleep(0.05)
+                await self.backend.idle(self.timer, 0.05)
 
-            print("\nPokrenuo vrtuljak\n\n", end="")
-            sleep(np.random.uniform(1., 3.))
-            print("\nVrtuljak zaustavljen\n\n", end="")
-
-            # Add this to make input more deterministic
-            sleep(0.25)
+            await self._ride()
 
             for _ in range(self.max_visitors):
-                self.out_q.put("Ustani")
+                self.out_q.put(("Ustani", self.timer.stamp()))
 
             # Not necessary, but makes sure you wait for everyone to come down from the carousel.
             while self.out_q.qsize() != 0:
-                sleep(0.05)
+                await self.backend.idle(self.timer, 0.05)
+
+            rides += 1
+            self._record_ride(self.max_visitors)
+            non_zero_count = len(self._workers) - finished.value
+
+        return rides
+
+    async def _dispatched_do(self):
+        if self.pool is not None:
+            return await self._pooled_do()
+
+        demand = Demand(self.backend, self._workers, ticketed=self.mode == "ticket")
+        self._in_q = demand.requests
+
+        for i, worker in enumerate(self._workers):
+            worker.start_dispatched(self.backend, demand, self.metrics.histogram(i))
+
+        rides = await self._operate(demand)
+        demand.dismiss(self.timer.stamp())
+
+        for worker in self._workers:
+            await self.backend.join(worker.process)
+
+        return rides
+
+    async def _pooled_do(self):
+        demand = self.pool.demand
+        await demand.reset(self._workers)
+        self._in_q = demand.requests
+
+        for i, worker in enumerate(self._workers):
+            self.pool.submit(i, VisitorPool._visit, worker, i)
+
+        rides = await self._operate(demand)
+        demand.dismiss(self.timer.stamp())
+
+        for i in range(len(self._workers)):
+            self.pool.wait(i)
+
+        return rides
+
+    async def _board(self, demand: Demand):
+        #   Every visitor that still has rides left will eventually ask for one,
+        #   so as long as there's enough of them, blocking on the queue is safe.
+        #   If some of them finish while we wait (on another carousel), we get
+        #   woken up by Demand.nudge.
+        riders = list()
+        deadline = None
+
+        try:
+            held = [await demand.held.get(timeout=0.)]
+        except queue.Empty:
+            held = list()
+
+        while len(riders) < self.max_visitors and len(riders) < demand.active.value \
+                and demand.active.value >= self.min_visitors:
+            if len(held) != 0:
+                request = held.pop()
+            else:
+                try:
+                    request = await demand.requests.get(timeout=self.timer.remaining(deadline))
+                except queue.Empty:
+                    break
+
+            if request is None:
+                continue
+
+            _, rider, stamp, _ = request
+
+            #   In virtual time between processes we never actually time out, so
+            #   we find out we should've left from a request made after the
+            #   deadline. It's first in line for the next ride.
+            if deadline is not None and stamp > deadline:
+                demand.hold(request)
+                self.timer.observe(deadline)
+                break
+
+            self.timer.observe(stamp)
+            riders.append(rider)
+
+            if deadline is None and self.boarding_timeout is not None:
+                deadline = self.timer.now() + self.boarding_timeout * self.time_scale
+
+        return riders
+
+    async def _operate(self, demand: Demand, index: int = 0):
+        rides = 0
+
+        while True:
+            idle_start = self.timer.now()
+
+            await demand.lock.acquire()
+            riders = await self._board(demand)
+            demand.lock.release()
+
+            self.metrics.add_idle(self.timer.now() - idle_start)
+
+            if len(riders) < self.min_visitors:
+                break
+
+            for rider in riders:
+                demand.channels[rider].send(("Sjedi", index, self.timer.stamp()))
+
+            for _ in riders:
+                await demand.done[index].acquire()
+
+            await self._ride()
+
+            for rider in riders:
+                demand.channels[rider].send(("Ustani", index, self.timer.stamp()))
+
+            for _ in riders:
+                await demand.done[index].acquire()
+
+            for rider in riders:
+                i = demand.index[rider]
+                demand.rides_left[i] -= 1
+
+                if demand.rides_left[i] == 0:
+                    demand.active.increment(-1)
+
+            rides += 1
+            self._record_ride(len(riders))
+
+            if demand.active.value < self.min_visitors:
+                demand.close()
+            elif self.boarding_timeout is not None and demand.carousels > 1:
+                #   Whoever is filling up might be waiting for visitors that just
+                #   took their last ride here.
+                demand.nudge()
+
+        return rides
+
+
+class CarouselPool:
+    def __init__(self, n_carousels: int = None, max_visitors: int = None, mode: str = None, time_scale: float = None,
+                 timer: Timer or str = None, boarding_timeout: float = None, trace: Tracer or str = None):
+        #   A number of carousels, each in its own process (so on its own core),
+        #   all drawing from the same visitors. Whichever carousel is free first
+        #   fills up first, with the same seating guarantees a single carousel
+        #   has in dispatch (or ticket) mode. Visitors are always processes here.
+
+        mode = "dispatch" if mode is None else mode
+
+        if mode not in ("dispatch", "ticket"):
+            raise ValueError(f"Mode \"{mode}\" is not a valid identifier!")
+
+        self._carousel_count = mp.cpu_count() if n_carousels is None else n_carousels
+        self._max_visitors = 4 if max_visitors is None else max_visitors
+        self._time_scale = 1. if time_scale is None else time_scale
+        self._timer = get_timer(timer)
+        self._backend = ProcessBackend()
+        self._trace = get_tracer(trace)
+        self._elapsed = None
+        self._metrics = None
+
+        self._mode = mode
+        self._carousels = [Carousel(max_visitors=self.max_visitors,
+                                    mode=mode,
+                                    time_scale=self.time_scale,
+                                    timer=self.timer.copy(),
+                                    backend=self._backend,
+                                    boarding_timeout=boarding_timeout,
+                                    name=f"vrtuljak {i}",
+                                    trace=self.trace)
+                           for i in range(self.carousel_count)]
+        self._workers: List[Visitor] = list()
+
+    # region Properties
+    @property
+    def carousel_count(self):
+        return self._carousel_count
+
+    @property
+    def carousels(self):
+        return self._carousels
+
+    @property
+    def max_visitors(self):
+        return self._max_visitors
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @property
+    def time_scale(self):
+        return self._time_scale
+
+    @property
+    def timer(self):
+        return self._timer
+
+    @property
+    def trace(self):
+        return self._trace
+
+    @property
+    def elapsed(self):
+        return self._elapsed
+
+    @property
+    def metrics(self):
+        return self._metrics
+    # endregion
+
+    @staticmethod
+    async def _operate(carousel: Carousel, demand: Demand, index: int, results: mp.Queue):
+        await carousel._operate(demand, index)
+        carousel.trace.flush()
+
+        results.put((carousel.metrics.occupancy.copy(), carousel.metrics.idle, carousel.timer.now()))
+
+    def do(self, n_visitors=None):
+        start = self.timer.now()
+
+        for i in range(8 if n_visitors is None else n_visitors):
+            self._workers.append(Visitor(f"{i}", time_scale=self.time_scale, timer=self.timer, trace=self.trace))
+
+        demand = Demand(self._backend, self._workers, carousels=self.carousel_count, ticketed=self.mode == "ticket")
+        waits = self._backend.array((len(self._workers), Histogram.size))
+
+        self._metrics = CarouselMetrics(waits=waits,
+                                        names=[worker.name for worker in self._workers],
+                                        seats=self.max_visitors,
+                                        max_rides=sum(worker.rides for worker in self._workers),
+                                        carousels=self.carousel_count)
+        self._metrics.start(start)
+
+        for i, worker in enumerate(self._workers):
+            worker.start_dispatched(self._backend, demand, self._metrics.histogram(i))
+
+        results = mp.Queue()
+        processes = list()
+
+        for i, carousel in enumerate(self.carousels):
+            carousel._start_metrics(self._workers, waits)
+            processes.append(self._backend.spawn(target=self._operate,
+                                                 args=(carousel, demand, i, results),
+                                                 name=carousel.name))
+
+        for _ in processes:
+            occupancy, idle, now = results.get()
+            self._metrics.merge(occupancy, idle, now)
+
+        for process in processes:
+            process.join()
+
+        demand.dismiss(start + self._metrics.elapsed)
+
+        for worker in self._workers:
+            worker.process.join()
 
-            non_zero_count = np.count_nonzero(np.array([x.process.exitcode is None for x in self._workers]))
+        self._elapsed = self._metrics.elapsed
+        self.trace.record(INFO, POOL_DONE, b"", time=start + self._elapsed)
+        self.trace.flush()
 
-        print("\nVrtuljak završio s radom\n", end="")
+        return self._metrics.rides
@@ -0,0 +1,122 @@
+#   Copyright 2020 Miljenko Šuflaj
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import heapq
+
+
+class IndexedHeap:
+    #   A binary min-heap of priorities, each under a unique key, which also
+    #   remembers where every key is, so any of them can be removed in O(log n)
+    #   and not just the first one. It's meant for a single process (or thread),
+    #   so unlike queue.PriorityQueue, there's no locking.
+
+    def __init__(self):
+        self._priorities = list()
+        self._keys = list()
+        self._index = dict()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def push(self, key, priority):
+        if key in self._index:
+            raise KeyError(f"Key \"{key}\" is already in the heap!")
+
+        self._priorities.append(priority)
+        self._keys.append(key)
+        self._index[key] = len(self._keys) - 1
+
+        self._sift_up(len(self._keys) - 1)
+
+    def peek(self):
+        return self._priorities[0]
+
+    def peek_key(self):
+        return self._keys[0]
+
+    def pop(self):
+        priority = self._priorities[0]
+        self._remove_at(0)
+
+        return priority
+
+    def remove(self, key):
+        priority = self._priorities[self._index[key]]
+        self._remove_at(self._index[key])
+
+        return priority
+
+    def smallest(self, k: int):
+        #   Keys of the k smallest priorities, smallest first. Only the children
+        #   of what was already taken can be next, so this looks at no more than
+        #   2k + 1 of them, however big the heap is.
+        keys = list()
+        frontier = [(self._priorities[0], 0)] if len(self._keys) != 0 else list()
+
+        while len(frontier) != 0 and len(keys) < k:
+            _, i = heapq.heappop(frontier)
+            keys.append(self._keys[i])
+
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(self._keys):
+                    heapq.heappush(frontier, (self._priorities[child], child))
+
+        return keys
+
+    # region Maintenance
+    def _swap(self, i: int, j: int):
+        self._priorities[i], self._priorities[j] = self._priorities[j], self._priorities[i]
+        self._keys[i], self._keys[j] = self._keys[j], self._keys[i]
+
+        self._index[self._keys[i]] = i
+        self._index[self._keys[j]] = j
+
+    def _remove_at(self, i: int):
+        last = len(self._keys) - 1
+        self._swap(i, last)
+
+        self._priorities.pop()
+        del self._index[self._keys.pop()]
+
+        if i != last:
+            self._sift_down(i)
+            self._sift_up(i)
+
+    def _sift_up(self, i: int):
+        while i > 0:
+            parent = (i - 1) // 2
+
+            if not self._priorities[i] < self._priorities[parent]:
+                break
+
+            self._swap(i, parent)
+            i = parent
+
+    def _sift_down(self, i: int):
+        while True:
+            smallest = i
+
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(self._keys) and self._priorities[child] < self._priorities[smallest]:
+                    smallest = child
+
+            if smallest == i:
+                break
+
+            self._swap(i, smallest)
+            i = smallest
+    # endregion
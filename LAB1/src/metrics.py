@@ -0,0 +1,207 @@
+#   Copyright 2020 Miljenko Šuflaj
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import json
+from math import isfinite, log2
+from typing import Dict, List
+
+import numpy as np
+
+
+def _finite(value):
+    if isinstance(value, dict):
+        return {key: _finite(x) for key, x in value.items()}
+
+    if isinstance(value, list):
+        return [_finite(x) for x in value]
+
+    if isinstance(value, float) and not isfinite(value):
+        return None
+
+    return value
+
+
+class Histogram:
+    #   Log-spaced buckets (32 per octave, so each about 2% wide, from 100 µs
+    #   to about 28 minutes) over a preallocated array of counts. Recording a
+    #   value is a single increment, and since the array can live in shared
+    #   memory, every visitor can fill its own row without any locking.
+
+    low = 1e-4
+    per_octave = 32
+    octaves = 24
+    size = octaves * per_octave + 2
+
+    def __init__(self, counts: np.ndarray = None):
+        self._counts = np.zeros(self.size, dtype=np.int64) if counts is None else counts
+
+    # region Properties
+    @property
+    def counts(self):
+        return self._counts
+
+    @property
+    def count(self):
+        return int(self._counts.sum())
+    # endregion
+
+    @staticmethod
+    def edges():
+        #   The upper edge of every bucket; the last one catches everything above.
+        return [Histogram.low * 2 ** (i / Histogram.per_octave) for i in range(Histogram.size - 1)] + [float("inf")]
+
+    def record(self, value: float):
+        if value < self.low:
+            self._counts[0] += 1
+        else:
+            self._counts[min(int(log2(value / self.low) * self.per_octave) + 1, self.size - 1)] += 1
+
+    @staticmethod
+    def percentile_of(counts: np.ndarray, q: float):
+        #   Conservative: returns the upper edge of the bucket the percentile falls
+        #   in, so one that falls above the last finite edge is infinite.
+        total = counts.sum()
+
+        if total == 0:
+            return None
+
+        index = int(np.searchsorted(np.cumsum(counts), q / 100. * total))
+
+        return Histogram.edges()[min(index, Histogram.size - 1)]
+
+    def percentile(self, q: float):
+        return self.percentile_of(self._counts, q)
+
+    @staticmethod
+    def summary_of(counts: np.ndarray):
+        return {"count": int(counts.sum()),
+                "p50": Histogram.percentile_of(counts, 50),
+                "p90": Histogram.percentile_of(counts, 90),
+                "p99": Histogram.percentile_of(counts, 99)}
+
+
+class CarouselMetrics:
+    def __init__(self, waits: np.ndarray, names: List[str], seats: int, max_rides: int, carousels: int = 1):
+        #   Waits are written by the visitors (one row each), everything else by
+        #   the carousel, so nothing here ever needs a lock. A pool of carousels
+        #   merges what each of them recorded once they're done.
+
+        self._waits = waits
+        self._names = names
+        self._seats = seats
+        self._carousels = carousels
+
+        self._occupancy = np.zeros(max_rides, dtype=np.int32)
+        self._rides = 0
+        self._idle = 0.
+        self._start = None
+        self._now = None
+
+        self._samples = list()
+
+    # region Properties
+    @property
+    def rides(self):
+        return self._rides
+
+    @property
+    def idle(self):
+        return self._idle
+
+    @property
+    def elapsed(self):
+        return 0. if self._start is None else self._now - self._start
+
+    @property
+    def occupancy(self):
+        return self._occupancy[:self._rides]
+
+    @property
+    def samples(self):
+        return self._samples
+    # endregion
+
+    def histogram(self, index: int):
+        return Histogram(self._waits[index])
+
+    # region Recording
+    def start(self, now: float):
+        self._start = now
+        self._now = now
+
+    def stop(self, now: float):
+        self._now = now
+
+    def add_idle(self, duration: float):
+        self._idle += duration
+
+    def add_ride(self, riders: int, now: float):
+        self._occupancy[self._rides] = riders
+        self._rides += 1
+        self._now = now
+
+    def sample(self):
+        self._samples.append(self.snapshot(full=False))
+
+    def merge(self, occupancy: np.ndarray, idle: float, now: float):
+        self._occupancy[self._rides:self._rides + len(occupancy)] = occupancy
+        self._rides += len(occupancy)
+        self._idle += idle
+        self._now = max(self._now, now)
+    # endregion
+
+    # region Serialization
+    def snapshot(self, full: bool = True) -> Dict:
+        elapsed = self.elapsed
+        occupancy = self.occupancy
+        capacity = elapsed * self._carousels
+
+        snapshot = \
+            {
+                "desc": "Carousel metrics",
+                "elapsed": elapsed,
+                "rides": self.rides,
+                "rides_per_minute": 60. * self.rides / elapsed if elapsed > 0 else None,
+                "idle":
+                    {
+                        "seconds": self.idle,
+                        "fraction": self.idle / capacity if capacity > 0 else None
+                    },
+                "occupancy":
+                    {
+                        "carousels": self._carousels,
+                        "seats": self._seats,
+                        "mean": float(occupancy.mean()) if self.rides != 0 else None
+                    },
+                "wait": Histogram.summary_of(self._waits.sum(axis=0))
+            }
+
+        if full:
+            snapshot["occupancy"]["per_ride"] = occupancy.tolist()
+            snapshot["wait"]["histogram"] = \
+                {
+                    "edges": Histogram.edges(),
+                    "counts": self._waits.sum(axis=0).tolist()
+                }
+            snapshot["wait"]["per_visitor"] = {name: Histogram.summary_of(self._waits[i])
+                                               for i, name in enumerate(self._names)}
+            snapshot["samples"] = list(self.samples)
+
+        return snapshot
+
+    def to_json(self, **kwargs):
+        #   Infinity isn't valid JSON, so the overflow bucket, and any percentile
+        #   that falls in it, is written as null.
+        return json.dumps(_finite(self.snapshot()), ensure_ascii=False, **kwargs)
+    # endregion
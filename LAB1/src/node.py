@@ -0,0 +1,74 @@
+#   Copyright 2020 Miljenko Šuflaj
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+#   A conference that isn't started from a single process: the rendezvous and
+#   every philosopher are started separately, on whichever machines, e.g.
+#
+#       python -m src.node rendezvous --philosophers 3 --host 0.0.0.0 --port 5000
+#       python -m src.node philosopher 192.168.1.10 --port 5000 --rounds 5
+#
+#   The rendezvous exits once everyone has joined, and every philosopher
+#   prints when it was at the table once it's done.
+
+import argparse
+import queue
+
+from .philosophers import protocol_to_class
+from .transports import Rendezvous, join
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NOS LAB1 conference over TCP")
+    subparsers = parser.add_subparsers(dest="role", required=True)
+
+    rendezvous_parser = subparsers.add_parser("rendezvous", help="hands out identifiers and addresses")
+    rendezvous_parser.add_argument("--philosophers", type=int, required=True)
+    rendezvous_parser.add_argument("--host", default="0.0.0.0")
+    rendezvous_parser.add_argument("--port", type=int, default=5000)
+
+    philosopher_parser = subparsers.add_parser("philosopher", help="joins the conference through the rendezvous")
+    philosopher_parser.add_argument("host")
+    philosopher_parser.add_argument("--port", type=int, default=5000)
+    philosopher_parser.add_argument("--identifier", type=int, default=None)
+    philosopher_parser.add_argument("--protocol", choices=list(protocol_to_class), default="lamport")
+    philosopher_parser.add_argument("--rounds", type=int, default=1)
+    philosopher_parser.add_argument("--seats", type=int, default=1)
+    philosopher_parser.add_argument("--time-scale", type=float, default=1.)
+    philosopher_parser.add_argument("--trace", choices=["off", "info", "debug"], default="debug")
+
+    args = parser.parse_args()
+
+    if args.role == "rendezvous":
+        rendezvous = Rendezvous(args.philosophers, args.host, args.port)
+        rendezvous.serve()
+        rendezvous.close()
+        return
+
+    endpoint = join(args.host, args.port, args.identifier)
+    philosopher = protocol_to_class[args.protocol](time_scale=args.time_scale, seats=args.seats, trace=args.trace)
+    philosopher.connect(endpoint)
+
+    results = queue.SimpleQueue()
+    philosopher.do(endpoint.identifier, results, args.rounds)
+
+    _, entries, _, sent = results.get()
+
+    for requested, seated, left in entries:
+        print(f"Filozof {endpoint.identifier}: zahtjev {requested:.6f}, za stolom {seated:.6f} - {left:.6f}")
+
+    print(f"Filozof {endpoint.identifier}: poslano {sent} poruka")
+
+
+if __name__ == "__main__":
+    main()
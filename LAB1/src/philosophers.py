@@ -13,14 +13,21 @@
 #    limitations under the License.
 
 
+import heapq
 import multiprocessing as mp
-import os
-from queue import PriorityQueue
-from time import sleep
+import queue
+import struct
 from typing import List
 
 import numpy as np
 
+from .heap import IndexedHeap
+from .pool import WorkerPool
+from .timer import Timer, get_timer
+from .trace import CONFERENCE_DONE, DEBUG, INFO, PHILOSOPHER_READS, PHILOSOPHER_SEATED, PHILOSOPHER_SENDS, Tracer, \
+    get_tracer
+from .transports import Endpoint, Transport, get_transport
+
 
 class Philosopher:
     __message_id_to_title =\
@@ -30,28 +37,42 @@ class Philosopher:
             2: "izlazak"
         }
 
-    def __init__(self, n_philosophers=None):
-        self._read_p = list()
-        self._write_p = list()
-        self._read_ids = list()
-
-        self._queue = PriorityQueue()
-        self._replies = PriorityQueue()
+    #   Message type, philosopher identifier, clock and the timer stamp.
+    __message = struct.Struct("<Biqd")
+
+    def __init__(self, n_philosophers=None, timer: Timer or str = None, time_scale: float = None,
+                 seats: int = None, trace: Tracer or str = None):
+        self._endpoint = None
+        self._time_scale = 1. if time_scale is None else time_scale
+        self._seats = 1 if seats is None else seats
+        self._trace = get_tracer(trace)
+        self._source = None
+
+        #   Requests are kept under the identifier of whoever made it, since no
+        #   philosopher can have more than one request in the queue at a time.
+        self._queue = IndexedHeap()
+        self._replies = 0
         self._clock = np.random.randint(0, int(1e6) if n_philosophers is None else n_philosophers)
         self._identifier = None
+        self._timer = get_timer(timer).copy()
 
-    # region Properties
-    @property
-    def read_p(self):
-        return self._read_p
+        self._received = 0
+        self._sent = 0
+        self._handlers = \
+            {
+                0: self._on_request,
+                1: self._on_reply,
+                2: self._on_exit
+            }
 
-    @property
-    def write_p(self):
-        return self._write_p
+        #   Every philosopher has its own generator, otherwise the forked processes
+        #   would all inherit the same state and sleep for the same durations.
+        self._random = np.random.RandomState()
 
+    # region Properties
     @property
-    def read_ids(self):
-        return self._read_ids
+    def endpoint(self):
+        return self._endpoint
 
     @property
     def queue(self):
@@ -68,12 +89,40 @@ class Philosopher:
     @property
     def identifier(self):
         return self._identifier
+
+    @property
+    def timer(self):
+        return self._timer
+
+    @property
+    def time_scale(self):
+        return self._time_scale
+
+    @property
+    def seats(self):
+        return self._seats
+
+    @property
+    def trace(self):
+        return self._trace
+
+    @property
+    def sent(self):
+        return self._sent
     # endregion
 
+    def connect(self, endpoint: Endpoint):
+        self._endpoint = endpoint
+
     # region Transformations
+    @staticmethod
+    def get_message(message_id: int, identifier: int, clock: int, stamp: float):
+        return Philosopher.__message.pack(message_id, identifier, clock, stamp)
+
     @staticmethod
     def get_message_tuple(message):
-        return [int(x) for x in message.strip().split("\t")]
+        #   The last field is the timer stamp, the rest are integers.
+        return Philosopher.__message.unpack_from(message)
 
     @staticmethod
     def message_to_interpretation(message_tuple):
@@ -86,155 +135,455 @@ class Philosopher:
     #   but doing it like this gives me more flexibility and isn't strictly
     #   prohibited by the task itself.
     # region Messaging
-    def request(self, identifier):
-        self._queue.put((self.clock, 0, identifier))
+    def _send(self, message_id: int, identifier: int, clock: int, destination: int = None):
+        self.endpoint.send(self.get_message(message_id, identifier, clock, self.timer.stamp()), destination)
+        self._sent += len(self.endpoint.peers) if destination is None else 1
 
-        request = f"0\t{identifier}\t{self.clock}\n"
+        if self.trace.level >= DEBUG:
+            self.trace.record(DEBUG, PHILOSOPHER_SENDS + message_id, self._source, identifier, clock, self.timer.now())
 
-        for pipe in self._write_p:
-            os.write(pipe, bytes(request, encoding="utf8"))
+    def request(self, identifier):
+        self._replies = 0
+        self._queue.push(identifier, (self.clock, 0, identifier))
 
-            message_interpretation = self.message_to_interpretation(Philosopher.get_message_tuple(request))
-            print(f"[Filozof {self.identifier}] šalje:\t'{message_interpretation}'\n", end="")
+        self._send(0, identifier, self.clock)
+        self.endpoint.flush()
 
-    def reply(self, identifier):
-        reply = f"1\t{identifier}\t{self.clock}\n"
+        #   Sending a request is an event too, so our next one is stamped later,
+        #   even if nobody else asked for the table in the meantime.
+        self._clock += 1
 
-        for pipe in self._write_p:
-            os.write(pipe, bytes(reply, encoding="utf8"))
+    def reply(self, identifier, destination: int):
+        #   Replies are written out together, once we have nothing else to do.
+        self._send(1, identifier, self.clock, destination)
 
-            message_interpretation = self.message_to_interpretation(Philosopher.get_message_tuple(reply))
-            print(f"[Filozof {self.identifier}] šalje:\t'{message_interpretation}'\n", end="")
+    def exit(self):
+        #   With more than one seat, whoever sat down before us may still be at
+        #   the table, so our request isn't necessarily the first one anymore.
+        queue_get = self.queue.remove(self.identifier)
 
-    def wait_for_requests(self):
-        for fd in self._read_p:
-            response = fd.readline()
+        self._send(2, queue_get[2], queue_get[0])
+        self.endpoint.flush()
 
-            message_tuple = Philosopher.get_message_tuple(response)
-            self.queue.put((message_tuple[2], message_tuple[0], message_tuple[1]))
+    def receive(self, timeout: float = None):
+        #   Handles whichever message arrives first, no matter who it's from, so
+        #   a slow peer never holds up the others. Returns False if nothing
+        #   arrived in time.
+        received = self.endpoint.receive(timeout)
 
-            self._clock = max(self._clock, message_tuple[2]) + 1
+        if received is None:
+            return False
 
-            message_interpretation = self.message_to_interpretation(message_tuple)
-            print(f"[Filozof {self.identifier}] čita:\t'{message_interpretation}'\n", end="")
+        message_tuple = Philosopher.get_message_tuple(received[1])
+        self.timer.observe(message_tuple[3])
+        self._received += 1
 
-        self.reply(self.identifier)
+        if self.trace.level >= DEBUG:
+            self.trace.record(DEBUG, PHILOSOPHER_READS + message_tuple[0], self._source, message_tuple[1],
+                              message_tuple[2], self.timer.now())
 
-    def wait_for_replies(self):
-        for fd in self._read_p:
-            reply = fd.readline()
+        self._handlers[message_tuple[0]](message_tuple)
 
-            message_tuple = Philosopher.get_message_tuple(reply)
-            self.replies.put((message_tuple[2], message_tuple[0], message_tuple[1]))
+        return True
 
-            message_interpretation = self.message_to_interpretation(message_tuple)
-            print(f"[Filozof {self.identifier}] čita:\t'{message_interpretation}'\n", end="")
+    def _on_request(self, message_tuple):
+        #   Replies go out right away, whatever we're doing, so nobody waits on
+        #   us any longer than it takes the message to get here.
+        self.queue.push(message_tuple[1], (message_tuple[2], message_tuple[0], message_tuple[1]))
+        self._clock = max(self._clock, message_tuple[2]) + 1
 
-    def exit(self):
-        queue_get = self.queue.get()
-        exit_message = f"2\t{queue_get[2]}\t{queue_get[0]}\n"
+        self.reply(self.identifier, message_tuple[1])
 
-        for pipe in self._write_p:
-            os.write(pipe, bytes(exit_message, encoding="utf8"))
+    def _on_reply(self, message_tuple):
+        self._replies += 1
 
-            message_interpretation = self.message_to_interpretation(Philosopher.get_message_tuple(exit_message))
-            print(f"[Filozof {self.identifier}] šalje:\t'{message_interpretation}'\n", end="")
+    def _on_exit(self, message_tuple):
+        #   Exits can reach us in a different order than philosophers left the
+        #   table in, but whoever left is done either way, so their request goes,
+        #   wherever it is. Their next request can only come after this exit.
+        self.queue.remove(message_tuple[1])
 
-    def wait_for_exits(self):
-        #   Before trying to understand how this works, please understand how the
-        #   pipe network is constructed with Conference.connect_philosophers.
-        #   Anyways, because it is constructed in a deterministic way, we know
-        #   what pipe to listen to based on the first element of the queue.
-        #   Without it, we'd have to use non-blocking pipes, which are not
-        #   available on every Unix and Windows OS like the regular pipes.
+    def owed(self, rounds: int):
+        #   How many messages we get over the given number of rounds: a request,
+        #   a reply and an exit from every peer, every round.
+        return 3 * rounds * len(self.endpoint.peers)
 
-        while True:
-            identifier_to_wait_for = self.queue.queue[0][2]
+    def can_enter(self):
+        #   Once everyone replied, every request made before ours is in the queue,
+        #   so if fewer than seats of them are still there, a seat is free for us.
+        if self.replies != len(self.endpoint.peers):
+            return False
 
-            if identifier_to_wait_for == self.identifier:
-                break
+        if self.seats == 1:
+            return self.queue.peek_key() == self.identifier
 
-            index_to_wait_for = identifier_to_wait_for
+        return self.identifier in self.queue.smallest(self.seats)
 
-            if index_to_wait_for > self.identifier:
-                index_to_wait_for -= 1
+    def wait_until(self, condition):
+        while not condition():
+            self.receive()
 
-            exit_message = self._read_p[index_to_wait_for].readline()
+    def think(self, duration: float):
+        #   In real time we keep answering everyone while we wait. Virtual time
+        #   can't be waited out, so there we answer them once we're done.
+        deadline = self.timer.now() + duration
+        timeout = self.timer.remaining(deadline)
 
-            self.queue.get()
+        if timeout is None:
+            self.timer.sleep(duration)
+            return
 
-            message_interpretation = self.message_to_interpretation(self.get_message_tuple(exit_message))
-            print(f"[Filozof {self.identifier}] čita:\t'{message_interpretation}'\n", end="")
+        while timeout > 0:
+            self.receive(timeout)
+            timeout = self.timer.remaining(deadline)
     # endregion
 
-    def do(self, identifier: int):
+    def do(self, identifier: int, results: mp.Queue = None, rounds: int = 1):
+        #   Every round is one visit to the table. We remember when we asked for
+        #   the table, when we sat down and when we left, every time.
         self._identifier = identifier
+        self._source = bytes(str(identifier), encoding="utf8")
+        entries = list()
+
+        for _ in range(rounds):
+            self.think(self._random.uniform(0.1, 2.) * self.time_scale)
+
+            requested = self.timer.now()
+            self.request(identifier)
+            self.wait_until(self.can_enter)
+            seated = self.timer.now()
 
-        sleep(np.random.uniform(0.1, 2.))
+            self.trace.record(INFO, PHILOSOPHER_SEATED, self._source, time=seated)
 
-        self.request(identifier)
-        self.wait_for_requests()
-        self.wait_for_replies()
+            self.think(3. * self.time_scale)
 
-        if self.queue.queue[0][2] != identifier:
-            self.wait_for_exits()
+            #   We're done as soon as we send the exit, which is when others can sit down.
+            entries.append((requested, seated, self.timer.now()))
+            self.exit()
 
-        print(f"\nFilozof {identifier} je za stolom\n\n", end="")
-        sleep(3.)
+        self.think(self._random.uniform(0.1, 2.) * self.time_scale)
 
-        self.exit()
-        sleep(np.random.uniform(0.1, 2.))
+        #   Whoever is slower than us is still waiting for our reply. We also read
+        #   everything else we're owed, so nothing is left behind in the channels
+        #   for whoever uses them next (see PhilosopherPool).
+        self.wait_until(lambda: self._received == self.owed(rounds))
+        self.endpoint.flush()
+        self.trace.flush()
+
+        if results is not None:
+            results.put((identifier, entries, self.timer.now(), self.sent))
+
+
+class RicartAgrawalaPhilosopher(Philosopher):
+    #   Instead of replying right away, a philosopher that wants the table (or
+    #   is at it) defers replies to anyone whose request comes after its own,
+    #   and sends them once it leaves. Having every reply then means everyone
+    #   before us is done, so there's no need for exits or a queue, and it takes
+    #   2(N - 1) messages to get to the table instead of 3(N - 1).
+
+    def __init__(self, n_philosophers=None, timer: Timer or str = None, time_scale: float = None,
+                 seats: int = None, trace: Tracer or str = None):
+        super().__init__(n_philosophers=n_philosophers, timer=timer, time_scale=time_scale, seats=seats,
+                         trace=trace)
+
+        if self.seats != 1:
+            raise ValueError(f"Protocol \"ricart-agrawala\" can't seat {self.seats} philosophers at once!")
+
+        self._requested = None
+        self._deferred = list()
+
+    def request(self, identifier):
+        self._replies = 0
+        self._requested = (self.clock, 0, identifier)
+
+        self._send(0, identifier, self.clock)
+        self.endpoint.flush()
+
+        self._clock += 1
+
+    def exit(self):
+        self._requested = None
+
+        for destination in self._deferred:
+            self.reply(self.identifier, destination)
+
+        self._deferred = list()
+        self.endpoint.flush()
+
+    def _on_request(self, message_tuple):
+        self._clock = max(self._clock, message_tuple[2]) + 1
+
+        if self._requested is not None and self._requested < (message_tuple[2], message_tuple[0], message_tuple[1]):
+            self._deferred.append(message_tuple[1])
+        else:
+            self.reply(self.identifier, message_tuple[1])
+
+    def owed(self, rounds: int):
+        return 2 * rounds * len(self.endpoint.peers)
+
+    def can_enter(self):
+        return self.replies == len(self.endpoint.peers)
+
+
+protocol_to_class = \
+    {
+        "lamport": Philosopher,
+        "ricart-agrawala": RicartAgrawalaPhilosopher
+    }
+
+
+class PhilosopherPool(WorkerPool):
+    #   A process for every philosopher, along with the transport they talk
+    #   through, made once and then reused by any number of conferences (see
+    #   Conference). Every conference gets new philosophers, but they run in
+    #   the same processes and talk through the same pipes (or sockets, or
+    #   shared memory), which are reset in between.
+
+    def __init__(self, n_philosophers: int, transport: Transport or str = None):
+        self._transport = get_transport(transport)
+
+        super().__init__(self._transport.open(n_philosophers), name="philosopher")
+
+    @property
+    def transport(self):
+        return self._transport
+
+    @staticmethod
+    def _attend(endpoint: Endpoint, philosopher: Philosopher, identifier: int, rounds: int):
+        endpoint.reset()
+        philosopher.connect(endpoint)
+
+        results = queue.SimpleQueue()
+        philosopher.do(identifier, results, rounds)
+
+        return results.get()
+
+    def close(self):
+        super().close()
+        self.transport.close()
 
 
 class Conference:
-    def __init__(self, n_philosophers: int):
+    def __init__(self, n_philosophers: int, timer: Timer or str = None, transport: Transport or str = None,
+                 protocol: str = None, rounds: int = None, time_scale: float = None, seats: int = None,
+                 trace: Tracer or str = None, pool: PhilosopherPool = None):
         #   Note that the constraints below are not arbitrary, but a task limitation.
-        #   Normally, the limit of philosophers is likely the square of pipes that
-        #   can be opened on one system (as they scale quadratically).
-
-        if n_philosophers is None or n_philosophers < 3:
+        #   With the pipe mesh (the default transport), the limit of philosophers
+        #   is likely the square of pipes that can be opened on one system (as
+        #   they scale quadratically). The other transports (see transports.py)
+        #   need a linear number of them, or none at all, so there's no upper limit.
+
+        #   The protocol is either "lamport" (the original) or "ricart-agrawala".
+        #
+        #   Every philosopher comes to the table rounds times (once by default),
+        #   over the same processes and connections. All of the philosophers'
+        #   delays are multiplied by time_scale.
+        #
+        #   The table has seats seats (one by default), and whoever's request is
+        #   among the first that many in the queue can sit down. Only the Lamport
+        #   protocol has a queue, so Ricart-Agrawala can only seat one.
+        #
+        #   Everyone records what they do through trace (see trace.py), which by
+        #   default prints every message as it's sent and read.
+        #
+        #   With a pool, philosophers run in its processes, which saves forking
+        #   them for every conference, and talk through its transport, so their
+        #   number and transport are the pool's.
+        protocol = "lamport" if protocol is None else protocol
+        seats = 1 if seats is None else seats
+
+        if protocol not in protocol_to_class:
+            raise ValueError(f"Protocol \"{protocol}\" is not a valid identifier!")
+
+        if seats < 1:
+            raise ValueError(f"A table needs at least 1 seat, got {seats}!")
+
+        if seats != 1 and protocol != "lamport":
+            raise ValueError(f"Protocol \"{protocol}\" can't seat {seats} philosophers at once!")
+
+        if pool is not None:
+            n_philosophers = pool.size
+            transport = pool.transport
+
+        transport = get_transport(transport)
+
+        if pool is None and (n_philosophers is None or n_philosophers < 3):
             n_philosophers = 3
 
-        if n_philosophers > 10:
+        if pool is None and n_philosophers > 10 and transport.transport_id == "mesh":
             n_philosophers = 10
 
         self._philosopher_count = n_philosophers
-        self._pipes = list()
+        self._timer = get_timer(timer)
+        self._transport = transport
+        self._protocol = protocol
+        self._rounds = 1 if rounds is None else rounds
+        self._time_scale = 1. if time_scale is None else time_scale
+        self._seats = seats
+        self._trace = get_tracer(trace)
+        self._pool = pool
+        self._elapsed = None
+        self._entries = None
+        self._time_to_table = None
+        self._messages = None
 
+    # region Properties
     @property
     def philosopher_count(self):
         return self._philosopher_count
 
-    def connect_philosophers(self, philosophers: List[Philosopher]):
-        for i in range(len(philosophers)):
-            for j in range(i + 1, len(philosophers)):
-                i_r, i_w = os.pipe()
-                j_r, j_w = os.pipe()
+    @property
+    def timer(self):
+        return self._timer
 
-                philosophers[i].read_p.append(os.fdopen(j_r))
-                philosophers[j].read_p.append(os.fdopen(i_r))
-                philosophers[i].write_p.append(i_w)
-                philosophers[j].write_p.append(j_w)
+    @property
+    def transport(self):
+        return self._transport
 
-                self._pipes.extend([i_r, i_w, j_r, j_w])
+    @property
+    def protocol(self):
+        return self._protocol
+
+    @property
+    def rounds(self):
+        return self._rounds
+
+    @property
+    def time_scale(self):
+        return self._time_scale
+
+    @property
+    def seats(self):
+        return self._seats
+
+    @property
+    def trace(self):
+        return self._trace
+
+    @property
+    def pool(self):
+        return self._pool
+
+    @property
+    def elapsed(self):
+        return self._elapsed
+
+    @property
+    def entries(self):
+        #   Every visit to the table, as (requested, seated, left), in the order
+        #   philosophers sat down in.
+        return self._entries
+
+    @property
+    def time_to_table(self):
+        #   How long each philosopher waited, from their request to the table,
+        #   for every round.
+        return self._time_to_table
+
+    @property
+    def messages(self):
+        #   How many messages were sent in total.
+        return self._messages
+
+    @property
+    def messages_per_entry(self):
+        return self.messages / len(self.entries)
+
+    @property
+    def entries_per_second(self):
+        #   Measured from the first request on, so starting the processes doesn't count.
+        return len(self.entries) / (self.entries[-1][2] - min(requested for requested, _, _ in self.entries))
+
+    @property
+    def occupancy(self):
+        #   The most philosophers that were at the table at once, which should
+        #   never be more than there are seats.
+        events = sorted([(seated, 1) for _, seated, _ in self.entries] +
+                        [(left, -1) for _, _, left in self.entries])
+        occupancy = 0
+        peak = 0
+
+        for _, delta in events:
+            occupancy += delta
+            peak = max(peak, occupancy)
+
+        return peak
+
+    @property
+    def synchronization_delay(self):
+        #   The mean time between someone leaving the table and the next one
+        #   sitting down, counting only those that were already waiting for it.
+        #   With more than one seat, the one who sat down took the seat that was
+        #   freed first, and not necessarily the one the previous diner left.
+        seated_until = list()
+        freed = list()
+        delays = list()
+
+        for requested, seated, left in self.entries:
+            while len(seated_until) != 0 and seated_until[0] <= seated:
+                heapq.heappush(freed, heapq.heappop(seated_until))
+
+            if len(seated_until) + len(freed) == self.seats:
+                freed_at = heapq.heappop(freed)
+
+                if requested <= freed_at:
+                    delays.append(seated - freed_at)
+
+            heapq.heappush(seated_until, left)
+
+        return sum(delays) / len(delays) if len(delays) != 0 else None
+    # endregion
+
+    def connect_philosophers(self, philosophers: List[Philosopher]):
+        for philosopher, endpoint in zip(philosophers, self.transport.open(len(philosophers))):
+            philosopher.connect(endpoint)
 
     def start(self):
-        philosophers = [Philosopher() for _ in range(self.philosopher_count)]
+        start = self.timer.now()
+
+        philosophers = [protocol_to_class[self.protocol](timer=self.timer,
+                                                         time_scale=self.time_scale,
+                                                         seats=self.seats,
+                                                         trace=self.trace)
+                        for _ in range(self.philosopher_count)]
+
+        #   Each philosopher reports the time it left at, which in virtual time is
+        #   the only way for us to know how long the conference took.
+        if self.pool is not None:
+            reports = self.pool.run([(PhilosopherPool._attend, (philosopher, i, self.rounds))
+                                     for i, philosopher in enumerate(philosophers)])
+        else:
+            reports = self._start_processes(philosophers)
+
+        self._elapsed = max(left for _, _, left, _ in reports) - start
+        self._entries = sorted((entry for _, entries, _, _ in reports for entry in entries), key=lambda x: x[1])
+        self._time_to_table = [seated - requested
+                               for _, entries, _, _ in sorted(reports) for requested, seated, _ in entries]
+        self._messages = sum(sent for *_, sent in reports)
+
+        self.trace.record(INFO, CONFERENCE_DONE, b"", time=start + self._elapsed)
+        self.trace.flush()
+
+        return self.elapsed
+
+    def _start_processes(self, philosophers: List[Philosopher]):
         self.connect_philosophers(philosophers)
 
         processes = list()
+        results = mp.Queue()
 
         for i, philosopher in enumerate(philosophers):
             processes.append(mp.Process(target=philosopher.do,
-                                        args=(i, ),
+                                        args=(i, results, self.rounds),
                                         name=f"philosopher {i}",
                                         daemon=True))
             processes[-1].start()
 
+        reports = [results.get() for _ in processes]
+
         for process in processes:
             process.join()
 
-        for pipe in self._pipes:
-            os.close(pipe)
+        self.transport.close()
 
-        print(f"\n\nKonferencija je završena!\n", end="")
+        return reports
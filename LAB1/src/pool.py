@@ -0,0 +1,102 @@
+#   Copyright 2020 Miljenko Šuflaj
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import multiprocessing as mp
+from typing import List
+
+
+class WorkerPool:
+    #   Processes that are forked once and then run any number of jobs, one at
+    #   a time each, instead of a process being forked (and torn down) for
+    #   every run. Pipes, queues and shared memory can only be shared with a
+    #   process by inheriting them, so whatever the workers talk through has
+    #   to exist before they're forked. Those are the resources, one for every
+    #   worker, made once with the pool and reset between runs.
+    #
+    #   A job is a function (which has to be importable, since it's pickled)
+    #   that gets the worker's resource followed by the job's arguments.
+
+    def __init__(self, resources: List, name: str = None):
+        self._resources = resources
+        self._name = "worker" if name is None else name
+        self._connections = list()
+        self._processes = list()
+
+        for i in range(len(resources)):
+            parent, child = mp.Pipe()
+
+            self._connections.append(parent)
+            self._processes.append(mp.Process(target=self._serve,
+                                              args=(child, resources[i]),
+                                              name=f"{self._name} {i}",
+                                              daemon=True))
+            self._processes[-1].start()
+
+    # region Properties
+    @property
+    def size(self):
+        return len(self._processes)
+
+    @property
+    def resources(self):
+        return self._resources
+
+    @property
+    def name(self):
+        return self._name
+    # endregion
+
+    @staticmethod
+    def _serve(connection, resource):
+        while True:
+            job = connection.recv()
+
+            if job is None:
+                return
+
+            target, args = job
+
+            try:
+                connection.send((True, target(resource, *args)))
+            except Exception as exception:
+                connection.send((False, exception))
+
+    def submit(self, index: int, target, *args):
+        self._connections[index].send((target, args))
+
+    def wait(self, index: int):
+        #   Returns whatever the job returned, or raises whatever it raised.
+        succeeded, result = self._connections[index].recv()
+
+        if not succeeded:
+            raise result
+
+        return result
+
+    def run(self, jobs: List):
+        #   Runs a (target, args) job on every worker, all at the same time.
+        for i, (target, args) in enumerate(jobs):
+            self.submit(i, target, *args)
+
+        return [self.wait(i) for i in range(len(jobs))]
+
+    def close(self):
+        for connection in self._connections:
+            connection.send(None)
+
+        for process in self._processes:
+            process.join()
+
+        self._connections = list()
+        self._processes = list()
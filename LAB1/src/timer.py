@@ -0,0 +1,376 @@
+#   Copyright 2020 Miljenko Šuflaj
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import asyncio
+import heapq
+import itertools
+import selectors
+import threading
+from time import monotonic, sleep
+
+
+class Timer:
+    #   The default, real time backend. Every process (or worker) gets its own
+    #   copy of a timer, and every message carries a stamp of the time it was
+    #   sent at, so a receiver can observe it. In real time there is nothing
+    #   to observe, since everyone shares the same (monotonic) clock.
+
+    def __init__(self):
+        self._timer_id = "real"
+
+    @property
+    def timer_id(self):
+        return self._timer_id
+
+    @property
+    def scheduler(self):
+        return None
+
+    def now(self):
+        return monotonic()
+
+    def stamp(self):
+        return self.now()
+
+    def observe(self, stamp: float):
+        pass
+
+    def remaining(self, deadline: float):
+        #   How long to block for (in real time) before the deadline passes.
+        return None if deadline is None else max(deadline - self.now(), 0.)
+
+    def sleep(self, duration: float):
+        sleep(duration)
+
+    def idle(self, duration: float):
+        #   Unlike sleep, this is not a simulated delay, but a pause that is there
+        #   only to give other processes some breathing room while polling.
+        sleep(duration)
+
+    async def asleep(self, duration: float):
+        await asyncio.sleep(duration)
+
+    async def aidle(self, duration: float):
+        await asyncio.sleep(duration)
+
+    def copy(self):
+        return self
+
+
+class _Waiter:
+    __slots__ = ("ready", "deadline", "run")
+
+    def __init__(self, ready, deadline: float, run: int):
+        self.ready = ready
+        self.deadline = deadline
+        self.run = run
+
+    def due(self, now: float):
+        return self.ready() or (self.deadline is not None and self.deadline <= now)
+
+
+class _VirtualSelector(selectors.DefaultSelector):
+    #   The event loop only ever waits on its selector once nothing is ready to
+    #   run, for as long as it takes until its earliest timer. So instead of
+    #   waiting, we skip the clock forward to it (unless something did come in,
+    #   like a callback from another thread).
+
+    def __init__(self, scheduler):
+        super().__init__()
+
+        self._scheduler = scheduler
+
+    def select(self, timeout: float = None):
+        if timeout is None or timeout <= 0:
+            return super().select(timeout)
+
+        events = super().select(0)
+
+        if len(events) == 0:
+            self._scheduler.forward(timeout)
+
+        return events
+
+
+class _VirtualEventLoop(asyncio.SelectorEventLoop):
+    def __init__(self, scheduler):
+        self._scheduler = scheduler
+
+        super().__init__(_VirtualSelector(scheduler))
+
+    def time(self):
+        return self._scheduler.now
+
+
+class Scheduler:
+    #   The clock of a VirtualTimer, along with whoever is waiting on it. On its
+    #   own (and in every process of the process backend) it's just a Lamport
+    #   clock: sleeping moves it forward, and so do the stamps of messages from
+    #   others, but nobody waits for anyone.
+    #
+    #   Threads and asyncio tasks share one, and then it's a discrete-event
+    #   scheduler. Everyone who sleeps or waits on a primitive of the backend
+    #   (see backends.py) blocks, with a wakeup in a priority queue keyed by
+    #   virtual time if there's a deadline, and the clock only moves to the
+    #   earliest wakeup once every worker is blocked, so the workers run in the
+    #   same order they would in real time. For threads that's done here, for
+    #   tasks by an event loop whose selector skips the clock forward instead
+    #   of waiting (its timers are a priority queue already).
+    #
+    #   The processes of the process backend aren't scheduled, so there only
+    #   the times are simulated, and not the order in which things happen.
+
+    def __init__(self, start: float = 0.):
+        self._now = start
+        self._reset()
+
+    def __getstate__(self):
+        return self._now
+
+    def __setstate__(self, state):
+        self._now = state
+        self._reset()
+
+    def _reset(self):
+        self._condition = threading.Condition()
+        self._threads = 0
+        self._blocked = set()
+        self._wakeups = list()
+        self._finished = set()
+        self._sequence = itertools.count()
+        self._run = 0
+        self._loop = None
+
+    # region Properties
+    @property
+    def now(self):
+        return self._now
+
+    @property
+    def condition(self):
+        return self._condition
+
+    @property
+    def scheduling(self):
+        return self._threads != 0 or self._loop is not None
+    # endregion
+
+    def observe(self, stamp: float):
+        if stamp > self._now:
+            self._now = stamp
+
+    def forward(self, duration: float):
+        self._now += duration
+
+    # region Threads
+    def start(self):
+        #   Makes the calling thread the first worker of a new run.
+        with self._condition:
+            self._run += 1
+            self._threads = 1
+            self._blocked = set()
+            self._wakeups = list()
+            self._finished = set()
+
+    def stop(self):
+        #   Whoever is still blocked once the run is over stays that way, so the
+        #   clock stops where the run did.
+        with self._condition:
+            self._threads = 0
+            self._condition.notify_all()
+
+    def enter(self):
+        #   Done by whoever spawns a thread, so the thread counts as running
+        #   from the start.
+        with self._condition:
+            self._threads += 1
+
+    def leave(self):
+        with self._condition:
+            self._threads -= 1
+            self._finished.add(threading.current_thread())
+            self._advance()
+            self._condition.notify_all()
+
+    def join(self, thread: threading.Thread):
+        with self._condition:
+            self.wait(lambda: thread in self._finished)
+
+    def notify(self):
+        #   Called (with the condition held) by whoever makes someone ready.
+        self._condition.notify_all()
+
+    def wait(self, ready, timeout: float = None):
+        #   Blocks (with the condition held) until ready() is true, or until
+        #   timeout (virtual) seconds pass, and tells which it was.
+        deadline = None if timeout is None else self._now + max(timeout, 0.)
+        waiter = _Waiter(ready, deadline, self._run)
+
+        if deadline is not None:
+            heapq.heappush(self._wakeups, (deadline, next(self._sequence), waiter))
+
+        self._blocked.add(waiter)
+
+        try:
+            while True:
+                if waiter.run == self._run and self._threads != 0:
+                    if ready():
+                        return True
+
+                    if deadline is not None and deadline <= self._now:
+                        return False
+
+                    if self._advance():
+                        continue
+
+                self._condition.wait()
+        finally:
+            self._blocked.discard(waiter)
+
+    def _advance(self):
+        #   Moves the clock to the earliest wakeup, if there's nobody left who
+        #   could run before it.
+        if self._threads == 0 or len(self._blocked) < self._threads:
+            return False
+
+        if any(waiter.due(self._now) for waiter in self._blocked):
+            return False
+
+        while len(self._wakeups) != 0 and self._wakeups[0][2] not in self._blocked:
+            heapq.heappop(self._wakeups)
+
+        if len(self._wakeups) == 0:
+            return False
+
+        self._now = max(self._now, heapq.heappop(self._wakeups)[0])
+        self._condition.notify_all()
+
+        return True
+    # endregion
+
+    def remaining(self, deadline: float):
+        #   Without scheduling, waiting doesn't move the clock, so a deadline can
+        #   only be missed by whoever checks the stamps of the messages that do
+        #   arrive.
+        if deadline is None or not self.scheduling:
+            return None
+
+        return max(deadline - self._now, 0.)
+
+    def sleep(self, duration: float):
+        if not self.scheduling:
+            if duration > 0:
+                self._now += duration
+
+            return
+
+        with self._condition:
+            self.wait(lambda: False, duration)
+
+    async def asleep(self, duration: float):
+        if self._loop is None:
+            self.sleep(duration)
+            await asyncio.sleep(0)
+        else:
+            await asyncio.sleep(max(duration, 0.))
+
+    def run_until_complete(self, coroutine):
+        #   Same as asyncio.run, on a loop that runs in virtual time.
+        loop = _VirtualEventLoop(self)
+        self._loop = loop
+        asyncio.set_event_loop(loop)
+
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            tasks = asyncio.all_tasks(loop)
+
+            for task in tasks:
+                task.cancel()
+
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            asyncio.set_event_loop(None)
+            self._loop = None
+            loop.close()
+
+
+class VirtualTimer(Timer):
+    #   Discrete-event virtual time: sleeping doesn't take any real time, it
+    #   just moves the clock forward, see Scheduler. Time is also propagated
+    #   through message stamps, same as Lamport clocks, so between processes
+    #   the time of an event is the length of the longest chain of delays that
+    #   causally precede it. Thousands of rides then take as much time as the
+    #   synchronization itself, with the same protocol.
+    #
+    #   Copies share the scheduler, until they're sent to another process.
+
+    def __init__(self, start: float = 0., scheduler: Scheduler = None):
+        super().__init__()
+
+        self._timer_id = "virtual"
+        self._scheduler = Scheduler(start) if scheduler is None else scheduler
+
+    @property
+    def scheduler(self):
+        return self._scheduler
+
+    def now(self):
+        return self._scheduler.now
+
+    def observe(self, stamp: float):
+        self._scheduler.observe(stamp)
+
+    def remaining(self, deadline: float):
+        return self._scheduler.remaining(deadline)
+
+    def sleep(self, duration: float):
+        self._scheduler.sleep(duration)
+
+    def idle(self, duration: float):
+        #   When scheduled, a pause to poll again is a simulated delay as well,
+        #   otherwise whoever polls would keep the clock from ever moving.
+        if self._scheduler.scheduling:
+            self._scheduler.sleep(duration)
+        else:
+            sleep(0)
+
+    async def asleep(self, duration: float):
+        await self._scheduler.asleep(duration)
+
+    async def aidle(self, duration: float):
+        await self._scheduler.asleep(duration if self._scheduler.scheduling else 0.)
+
+    def copy(self):
+        return VirtualTimer(scheduler=self._scheduler)
+
+
+name_to_timer = \
+    {
+        "real": Timer,
+        "virtual": VirtualTimer
+    }
+
+
+def get_timer(timer: Timer or str = None):
+    if timer is None:
+        return Timer()
+
+    if isinstance(timer, Timer):
+        return timer
+
+    if timer not in name_to_timer:
+        raise ValueError(f"Timer \"{timer}\" is not a valid identifier!")
+
+    return name_to_timer[timer]()
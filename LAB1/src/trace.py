@@ -0,0 +1,331 @@
+#   Copyright 2020 Miljenko Šuflaj
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import argparse
+import glob
+import os
+import struct
+import sys
+import threading
+import weakref
+
+import numpy as np
+
+OFF = 0
+INFO = 1
+DEBUG = 2
+
+name_to_level = \
+    {
+        "off": OFF,
+        "info": INFO,
+        "debug": DEBUG
+    }
+
+# region Events
+PHILOSOPHER_SENDS = 0
+PHILOSOPHER_READS = 3
+PHILOSOPHER_SEATED = 6
+CONFERENCE_DONE = 7
+VISITOR_SEATED = 8
+VISITOR_LEFT = 9
+VISITOR_DONE = 10
+CAROUSEL_STARTED = 11
+CAROUSEL_STOPPED = 12
+CAROUSEL_DONE = 13
+POOL_DONE = 14
+
+#   Philosophers send (and read) three types of messages, so each of those
+#   is an event of its own, offset by the type of the message.
+event_to_format = \
+    {
+        PHILOSOPHER_SENDS + 0: "[Filozof {source}] šalje:\t'zahtjev(i = {a}, T[i] = {b})'\n",
+        PHILOSOPHER_SENDS + 1: "[Filozof {source}] šalje:\t'odgovor(i = {a}, T[i] = {b})'\n",
+        PHILOSOPHER_SENDS + 2: "[Filozof {source}] šalje:\t'izlazak(i = {a}, T[i] = {b})'\n",
+        PHILOSOPHER_READS + 0: "[Filozof {source}] čita:\t'zahtjev(i = {a}, T[i] = {b})'\n",
+        PHILOSOPHER_READS + 1: "[Filozof {source}] čita:\t'odgovor(i = {a}, T[i] = {b})'\n",
+        PHILOSOPHER_READS + 2: "[Filozof {source}] čita:\t'izlazak(i = {a}, T[i] = {b})'\n",
+        PHILOSOPHER_SEATED: "\nFilozof {source} je za stolom\n\n",
+        CONFERENCE_DONE: "\n\nKonferencija je završena!\n",
+        VISITOR_SEATED: "Sjeo posjetitelj {source}\n",
+        VISITOR_LEFT: "Sišao posjetitelj {source}\n",
+        VISITOR_DONE: "\nPosjetitelj {source} završio.\n",
+        CAROUSEL_STARTED: "\nPokrenuo {source}\n\n",
+        CAROUSEL_STOPPED: "\n{Source} zaustavljen\n\n",
+        CAROUSEL_DONE: "\nVrtuljak završio s radom\n",
+        POOL_DONE: "\nVrtuljci završili s radom\n"
+    }
+# endregion
+
+#   The time of the event (by the timer of whoever recorded it), its level,
+#   what happened, who it happened to and two numbers that go with it.
+_record = struct.Struct("<dBB16sqq")
+record_dtype = np.dtype([("time", "<f8"),
+                         ("level", "u1"),
+                         ("event", "u1"),
+                         ("source", "S16"),
+                         ("a", "<i8"),
+                         ("b", "<i8")])
+
+#   Whatever a process was tracing before it forked stays with it. The child
+#   starts with an empty buffer (and its own file), see Tracer._reset.
+_tracers = weakref.WeakSet()
+
+
+def _reset_after_fork():
+    for tracer in _tracers:
+        tracer._reset()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_level(level: int or str = None):
+    if level is None:
+        return DEBUG
+
+    if isinstance(level, int):
+        return level
+
+    if level not in name_to_level:
+        raise ValueError(f"Level \"{level}\" is not a valid identifier!")
+
+    return name_to_level[level]
+
+
+def render(event: int, source: str, a: int = 0, b: int = 0):
+    return event_to_format[event].format(source=source, Source=source.capitalize(), a=a, b=b)
+
+
+class _Ring:
+    #   Only the thread that records into a ring moves its head, and only the
+    #   writer moves its tail, so neither needs a lock to do it (each reads the
+    #   other's index once, and a stale one only makes the ring look fuller, or
+    #   emptier, than it is).
+    __slots__ = ("buffer", "head", "tail", "drained", "thread")
+
+    def __init__(self, capacity: int):
+        self.buffer = bytearray(capacity * _record.size)
+        self.head = 0
+        self.tail = 0
+        self.drained = threading.Event()
+        self.thread = threading.current_thread()
+
+
+class Tracer:
+    #   Without a directory, events are printed as they happen, which is what
+    #   the tasks ask for. With one, every thread records them into its own
+    #   preallocated ring buffer, as binary records, without taking a lock,
+    #   and a background thread writes them out to {pid}.trace once half of it
+    #   fills up, so recording an event never waits on a write (unless the
+    #   writer falls a whole buffer behind). See merge for putting them back
+    #   together.
+    #
+    #   Only events of the given level or below are recorded, so with "off",
+    #   recording is a single comparison.
+
+    def __init__(self, directory: str = None, level: int or str = None, capacity: int = None):
+        self._directory = directory
+        self._level = get_level(level)
+        self._capacity = 4096 if capacity is None else capacity
+
+        if directory is not None:
+            #   The directory belongs to the tracer, so the traces of an earlier
+            #   run don't end up in the timeline of this one.
+            os.makedirs(directory, exist_ok=True)
+
+            for path in glob.glob(os.path.join(directory, "*.trace")):
+                os.remove(path)
+
+        self._file = None
+        self._reset()
+
+        _tracers.add(self)
+
+    def __getstate__(self):
+        return self._directory, self._level, self._capacity
+
+    def __setstate__(self, state):
+        #   A tracer sent to another process starts out empty there, the same as
+        #   one that was forked.
+        self._directory, self._level, self._capacity = state
+        self._file = None
+        self._reset()
+
+        _tracers.add(self)
+
+    def _reset(self):
+        if self._file is not None:
+            os.close(self._file)
+
+        self._file = None
+        self._writer = None
+        self._rings = list()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._pending = threading.Event()
+
+    # region Properties
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def level(self):
+        return self._level
+
+    @property
+    def capacity(self):
+        return self._capacity
+    # endregion
+
+    def record(self, level: int, event: int, source: bytes, a: int = 0, b: int = 0, time: float = 0.):
+        if level > self._level:
+            return
+
+        if self._directory is None:
+            print(render(event, str(source, encoding="utf8"), a, b), end="")
+            return
+
+        try:
+            ring = self._local.ring
+        except AttributeError:
+            ring = self._local.ring = self._add_ring()
+
+        head = ring.head
+
+        if head - ring.tail == self._capacity:
+            self._wait_for(ring)
+
+        _record.pack_into(ring.buffer, (head % self._capacity) * _record.size, time, level, event, source, a, b)
+        ring.head = head + 1
+
+        if head + 1 - ring.tail == self._capacity // 2:
+            self._pending.set()
+
+    def _add_ring(self):
+        #   Happens once a thread, so this is the only place recording takes a
+        #   lock.
+        ring = _Ring(self._capacity)
+
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, daemon=True, name="tracer")
+                self._writer.start()
+
+            self._rings.append(ring)
+
+        return ring
+
+    def _wait_for(self, ring: _Ring):
+        #   The writer fell a whole buffer behind. The event is cleared before
+        #   looking at the tail, so a write that finishes in between isn't missed.
+        while True:
+            ring.drained.clear()
+
+            if ring.head - ring.tail != self._capacity:
+                return
+
+            self._pending.set()
+            ring.drained.wait()
+
+    def flush(self):
+        #   Writes out everything recorded so far, and returns once it's written.
+        if self._directory is not None:
+            self._write()
+
+    def _write_loop(self):
+        while True:
+            self._pending.wait()
+            self._pending.clear()
+            self._write()
+
+    def _write(self):
+        #   The records between the tail and the head of a ring are only ever
+        #   touched here, so they're written without holding up whoever is
+        #   recording. Once a thread is gone and its ring is written out, the
+        #   ring goes too.
+        with self._write_lock:
+            with self._lock:
+                rings = list(self._rings)
+
+            for ring in rings:
+                tail, head = ring.tail, ring.head
+
+                if tail != head:
+                    self._write_ring(ring, tail, head)
+
+                if not ring.thread.is_alive() and ring.tail == ring.head:
+                    with self._lock:
+                        self._rings.remove(ring)
+
+    def _write_ring(self, ring: _Ring, tail: int, head: int):
+        if self._file is None:
+            self._file = os.open(os.path.join(self.directory, f"{os.getpid()}.trace"),
+                                 os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+
+        view = memoryview(ring.buffer)
+        start = (tail % self._capacity) * _record.size
+        end = (head % self._capacity) * _record.size
+
+        for chunk in ([view[start:end]] if start < end else [view[start:], view[:end]]):
+            while len(chunk) != 0:
+                chunk = chunk[os.write(self._file, chunk):]
+
+        ring.tail = head
+        ring.drained.set()
+
+
+def get_tracer(trace: Tracer or str = None):
+    if trace is None:
+        return Tracer()
+
+    if isinstance(trace, Tracer):
+        return trace
+
+    return Tracer(level=trace)
+
+
+def merge(directory: str, level: int or str = None):
+    #   Every process wrote its own trace, in the order it recorded events in.
+    #   Put together, they're ordered by time, and a tie keeps the order they
+    #   came in (virtual time, for one, ties a lot).
+    paths = sorted(glob.glob(os.path.join(directory, "*.trace")))
+    records = np.concatenate([np.fromfile(path, dtype=record_dtype) for path in paths]) if len(paths) != 0 \
+        else np.zeros(0, dtype=record_dtype)
+    records = records[records["level"] <= get_level(level)]
+
+    return records[np.argsort(records["time"], kind="stable")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merges the traces of every process into a single timeline")
+    parser.add_argument("directory")
+    parser.add_argument("--level", choices=list(name_to_level), default="debug")
+    parser.add_argument("--times", action="store_true", help="prefix every event with its time")
+
+    args = parser.parse_args()
+
+    for record in merge(args.directory, args.level):
+        text = render(record["event"], str(record["source"], encoding="utf8"), record["a"], record["b"])
+
+        if args.times:
+            text = f"{record['time']:.6f}\t{text.strip()}\n"
+
+        sys.stdout.write(text)
+
+
+if __name__ == "__main__":
+    main()
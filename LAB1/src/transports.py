@@ -0,0 +1,733 @@
+#   Copyright 2020 Miljenko Šuflaj
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import multiprocessing as mp
+import os
+import select
+import selectors
+import socket
+import struct
+import threading
+from collections import deque
+from time import monotonic
+from typing import List
+
+#   Every message travels in a frame: who sent it, who it's for (or everyone,
+#   if it's a broadcast) and how long it is, followed by the message itself.
+_header = struct.Struct("<iiI")
+
+BROADCAST = -1
+_STOP = -2
+
+
+def _frame(source: int, destination: int, payload: bytes):
+    return _header.pack(source, destination, len(payload)) + payload
+
+
+def _write_all(fd: int, data: bytes):
+    written = os.write(fd, data)
+
+    #   Blocking pipes only ever write part of something larger than PIPE_BUF.
+    if written != len(data):
+        view = memoryview(data)[written:]
+
+        while len(view) != 0:
+            view = view[os.write(fd, view):]
+
+
+class _ReadBuffer:
+    #   A preallocated buffer a pipe is read straight into. Frames are handed
+    #   out as views into it, so nothing is copied on the way.
+
+    def __init__(self, size: int = 1 << 16):
+        self._data = bytearray(size)
+        self._view = memoryview(self._data)
+        self._start = 0
+        self._end = 0
+
+    def fill(self, fd: int):
+        #   Whatever is left over (an incomplete frame) is moved to the front.
+        if self._start != 0:
+            length = self._end - self._start
+            self._data[:length] = self._data[self._start:self._end]
+            self._start, self._end = 0, length
+
+        if self._end == len(self._data):
+            raise ValueError(f"Frame doesn't fit into a {len(self._data)} byte buffer!")
+
+        read = os.readv(fd, [self._view[self._end:]])
+        self._end += read
+
+        return read
+
+    def clear(self):
+        self._start = 0
+        self._end = 0
+
+    def frame(self):
+        if self._end - self._start < _header.size:
+            return None
+
+        source, _, length = _header.unpack_from(self._data, self._start)
+        start = self._start + _header.size
+
+        if self._end < start + length:
+            return None
+
+        self._start = start + length
+
+        return source, self._view[start:start + length]
+
+
+class Endpoint:
+    #   A philosopher's end of a transport. Messages are just bytes, received
+    #   in whatever order they arrive in, along with who sent them. Messages
+    #   from the same sender always arrive in the order they were sent in.
+    #
+    #   Sent messages may be held back and written together, until flush is
+    #   called or the endpoint waits to receive something. Received messages
+    #   are views that are only valid until the next call to receive.
+
+    def __init__(self, identifier: int, count: int):
+        self._identifier = identifier
+        self._count = count
+        self._peers = [i for i in range(count) if i != identifier]
+
+    # region Properties
+    @property
+    def identifier(self):
+        return self._identifier
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def peers(self):
+        return self._peers
+    # endregion
+
+    def send(self, payload: bytes, destination: int = None):
+        #   Without a destination, the message is sent to every peer.
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def receive(self, timeout: float = None):
+        #   Returns (sender, message), or None if nothing arrived in time.
+        raise NotImplementedError
+
+    def reset(self):
+        #   Forgets whatever a run left behind, so the endpoint can be used for
+        #   the next one (see PhilosopherPool). Philosophers read everything
+        #   they're sent, so by then there's nothing left in the channels.
+        pass
+
+
+class Transport:
+    #   Connects a number of philosophers, each getting an endpoint. Everything
+    #   is made in the parent, before the philosophers are forked.
+
+    def __init__(self):
+        self._transport_id = None
+
+    @property
+    def transport_id(self):
+        return self._transport_id
+
+    def open(self, count: int) -> List[Endpoint]:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class _StreamEndpoint(Endpoint):
+    #   Reads frames from any number of pipes, from whichever has something
+    #   first, so a peer that is slow to write never holds up the others.
+
+    def __init__(self, identifier: int, count: int):
+        super().__init__(identifier, count)
+
+        self._readers = list()
+        self._buffers = dict()
+        self._ready = deque()
+        self._selector = None
+
+    def _add_reader(self, fd: int):
+        self._readers.append(fd)
+
+    def reset(self):
+        self._ready.clear()
+
+        for buffer in self._buffers.values():
+            buffer.clear()
+
+    def receive(self, timeout: float = None):
+        deadline = None if timeout is None else monotonic() + timeout
+
+        while True:
+            #   Pipes that had something to read are taken in turns, so one busy
+            #   peer can't crowd out the others.
+            while len(self._ready) != 0:
+                fd = self._ready.popleft()
+                frame = self._buffers[fd].frame()
+
+                if frame is not None:
+                    self._ready.append(fd)
+                    return frame
+
+            self.flush()
+
+            #   Made on first use, so that it's made in the philosopher's process.
+            if self._selector is None:
+                self._selector = selectors.DefaultSelector()
+
+                for fd in self._readers:
+                    self._buffers[fd] = _ReadBuffer()
+                    self._selector.register(fd, selectors.EVENT_READ)
+
+            events = self._selector.select(None if deadline is None else max(deadline - monotonic(), 0.))
+
+            if len(events) == 0:
+                return None
+
+            for key, _ in events:
+                try:
+                    read = self._buffers[key.fd].fill(key.fd)
+                except ConnectionResetError:
+                    read = 0
+
+                #   Only sockets are ever closed on us, by peers that are done.
+                if read == 0:
+                    self._selector.unregister(key.fd)
+
+                self._ready.append(key.fd)
+
+
+# region Mesh
+class _MeshEndpoint(_StreamEndpoint):
+    def __init__(self, identifier: int, count: int):
+        super().__init__(identifier, count)
+
+        self._writers = [None] * count
+        self._outboxes = [bytearray() for _ in range(count)]
+        self._pending = set()
+
+    def connect(self, peer: int, reader: int, writer: int):
+        self._add_reader(reader)
+        self._writers[peer] = writer
+
+    def reset(self):
+        super().reset()
+
+        for outbox in self._outboxes:
+            outbox.clear()
+
+        self._pending.clear()
+
+    def send(self, payload: bytes, destination: int = None):
+        frame = _frame(self.identifier, BROADCAST if destination is None else destination, payload)
+
+        for peer in (self.peers if destination is None else [destination]):
+            self._outboxes[peer] += frame
+            self._pending.add(peer)
+
+    def flush(self):
+        for peer in self._pending:
+            outbox = self._outboxes[peer]
+            self._write(peer, outbox)
+            outbox.clear()
+
+        self._pending.clear()
+
+    def _write(self, peer: int, data: bytes):
+        _write_all(self._writers[peer], data)
+
+
+class MeshTransport(Transport):
+    #   The original solution: a pair of pipes between every two philosophers,
+    #   so the number of file descriptors grows quadratically.
+
+    def __init__(self):
+        super().__init__()
+
+        self._transport_id = "mesh"
+        self._pipes = list()
+
+    def open(self, count: int):
+        endpoints = [_MeshEndpoint(i, count) for i in range(count)]
+
+        for i in range(count):
+            for j in range(i + 1, count):
+                i_r, i_w = os.pipe()
+                j_r, j_w = os.pipe()
+
+                endpoints[i].connect(j, j_r, i_w)
+                endpoints[j].connect(i, i_r, j_w)
+
+                self._pipes.extend([i_r, i_w, j_r, j_w])
+
+        return endpoints
+
+    def close(self):
+        for pipe in self._pipes:
+            os.close(pipe)
+
+        self._pipes = list()
+# endregion
+
+
+# region Hub
+class _HubEndpoint(_StreamEndpoint):
+    def __init__(self, identifier: int, count: int, inbound: int, outbound: int):
+        super().__init__(identifier, count)
+
+        self._inbound = inbound
+        self._outbox = bytearray()
+        self._add_reader(outbound)
+
+    def send(self, payload: bytes, destination: int = None):
+        frame = _frame(self.identifier, BROADCAST if destination is None else destination, payload)
+
+        #   Everyone writes into the same pipe, which is only safe as long as
+        #   every write is atomic, so that's as much as we can write at once.
+        if len(frame) > select.PIPE_BUF:
+            raise ValueError(f"Message of {len(payload)} bytes is too long for the hub!")
+
+        if len(self._outbox) + len(frame) > select.PIPE_BUF:
+            self.flush()
+
+        self._outbox += frame
+
+    def flush(self):
+        if len(self._outbox) != 0:
+            os.write(self._inbound, self._outbox)
+            self._outbox.clear()
+
+    def reset(self):
+        super().reset()
+        self._outbox.clear()
+
+
+class HubTransport(Transport):
+    #   Every philosopher sends everything to a broker process (through one
+    #   shared pipe), which forwards it through a pipe of the receiver's own.
+    #   Broadcasts are fanned out by the broker, so each one costs the sender a
+    #   single write. That's a linear number of file descriptors.
+
+    def __init__(self):
+        super().__init__()
+
+        self._transport_id = "hub"
+        self._inbound = None
+        self._pipes = list()
+        self._hub = None
+
+    def open(self, count: int):
+        inbound_r, inbound_w = os.pipe()
+        outbound = [os.pipe() for _ in range(count)]
+
+        self._inbound = inbound_w
+        self._pipes = [inbound_r, inbound_w] + [fd for pipe in outbound for fd in pipe]
+        self._hub = mp.Process(target=self._serve,
+                               args=(inbound_r, [w for _, w in outbound]),
+                               name="hub",
+                               daemon=True)
+        self._hub.start()
+
+        return [_HubEndpoint(i, count, inbound_w, r) for i, (r, _) in enumerate(outbound)]
+
+    @staticmethod
+    def _serve(inbound: int, outbound: List[int]):
+        #   The broker never blocks on a slow receiver: whatever can't be written
+        #   right away waits in a backlog until its pipe becomes writable again.
+        selector = selectors.DefaultSelector()
+        selector.register(inbound, selectors.EVENT_READ, None)
+
+        backlogs = [bytearray() for _ in outbound]
+        buffer = bytearray()
+
+        for fd in outbound:
+            os.set_blocking(fd, False)
+
+        def forward(destination: int, data: bytes):
+            backlog = backlogs[destination]
+
+            if len(backlog) == 0:
+                try:
+                    data = data[os.write(outbound[destination], data):]
+                except BlockingIOError:
+                    pass
+
+                if len(data) != 0:
+                    selector.register(outbound[destination], selectors.EVENT_WRITE, destination)
+
+            backlog += data
+
+        while True:
+            for key, _ in selector.select():
+                if key.data is not None:
+                    backlog = backlogs[key.data]
+                    del backlog[:os.write(key.fd, backlog)]
+
+                    if len(backlog) == 0:
+                        selector.unregister(key.fd)
+
+                    continue
+
+                buffer += os.read(inbound, 1 << 16)
+
+                while len(buffer) >= _header.size:
+                    source, destination, length = _header.unpack_from(buffer)
+                    end = _header.size + length
+
+                    if len(buffer) < end:
+                        break
+
+                    if destination == _STOP:
+                        return
+
+                    frame = bytes(buffer[:end])
+                    del buffer[:end]
+
+                    if destination == BROADCAST:
+                        for peer in range(len(outbound)):
+                            if peer != source:
+                                forward(peer, frame)
+                    else:
+                        forward(destination, frame)
+
+    def close(self):
+        os.write(self._inbound, _frame(_STOP, _STOP, b""))
+        self._hub.join()
+
+        for pipe in self._pipes:
+            os.close(pipe)
+
+        self._pipes = list()
+# endregion
+
+
+# region Shared memory
+class _Ring:
+    #   A bounded buffer of fixed size slots in shared memory, with any number
+    #   of writers and a single reader. Writers take slots in order under the
+    #   lock, and a slot is only counted as an item once it's written, so the
+    #   reader (which doesn't need the lock) always sees whole messages. The
+    #   reader gets a view of the slot, which is only freed on its next read.
+
+    def __init__(self, slots: int, slot_size: int):
+        self._slots = slots
+        self._slot_size = slot_size
+        self._buffer = mp.RawArray("B", slots * slot_size)
+        self._view = None
+        self._head = mp.RawValue("i", 0)
+        self._tail = 0
+        self._held = False
+
+        self._lock = mp.Lock()
+        self._free = mp.Semaphore(slots)
+        self._items = mp.Semaphore(0)
+
+    def put(self, frame: bytes):
+        if len(frame) > self._slot_size:
+            raise ValueError(f"Frame of {len(frame)} bytes doesn't fit into a {self._slot_size} byte slot!")
+
+        self._free.acquire()
+
+        with self._lock:
+            offset = self._head.value * self._slot_size
+            self._head.value = (self._head.value + 1) % self._slots
+            self._get_view()[offset:offset + len(frame)] = frame
+
+        self._items.release()
+
+    def _get_view(self):
+        if self._view is None:
+            self._view = memoryview(self._buffer).cast("B")
+
+        return self._view
+
+    def release(self):
+        #   Frees the slot of the last message read, which is no longer needed.
+        if self._held:
+            self._held = False
+            self._free.release()
+
+    def get(self, timeout: float = None):
+        self.release()
+
+        if not self._items.acquire(timeout=timeout):
+            return None
+
+        view = self._get_view()
+        offset = self._tail * self._slot_size
+        self._tail = (self._tail + 1) % self._slots
+        self._held = True
+
+        source, _, length = _header.unpack_from(view, offset)
+
+        return source, view[offset + _header.size:offset + _header.size + length]
+
+
+class _RingEndpoint(Endpoint):
+    def __init__(self, identifier: int, count: int, rings: List[_Ring]):
+        super().__init__(identifier, count)
+
+        self._rings = rings
+
+    def send(self, payload: bytes, destination: int = None):
+        frame = _frame(self.identifier, BROADCAST if destination is None else destination, payload)
+
+        for peer in (self.peers if destination is None else [destination]):
+            self._rings[peer].put(frame)
+
+    def receive(self, timeout: float = None):
+        return self._rings[self.identifier].get(timeout)
+
+    def reset(self):
+        self._rings[self.identifier].release()
+
+
+class ShmTransport(Transport):
+    #   Every philosopher has a ring buffer in shared memory that the others
+    #   write into. Apart from the semaphores, no file descriptors are needed.
+    #
+    #   A ring has to fit every message that can be in flight towards its owner,
+    #   otherwise two philosophers writing to each other's full rings would wait
+    #   forever, hence the default of 4 slots per philosopher.
+
+    def __init__(self, slots: int = None, slot_size: int = None):
+        super().__init__()
+
+        self._transport_id = "shm"
+        self._slots = slots
+        self._slot_size = 64 if slot_size is None else slot_size
+
+    def open(self, count: int):
+        slots = 4 * count if self._slots is None else self._slots
+        rings = [_Ring(slots, self._slot_size) for _ in range(count)]
+
+        return [_RingEndpoint(i, count, rings) for i in range(count)]
+# endregion
+
+
+# region TCP
+#   A philosopher asks the rendezvous for an identifier (any, or a particular
+#   one) and tells it the port it listens on. Once everyone has joined, each
+#   gets its identifier, how many there are and where every one of them listens.
+_join_request = struct.Struct("<iH")
+_welcome = struct.Struct("<ii")
+_address = struct.Struct("<64sH")
+_handshake = struct.Struct("<i")
+
+
+def _receive_exactly(connection: socket.socket, size: int):
+    data = bytearray(size)
+    view = memoryview(data)
+
+    while len(view) != 0:
+        received = connection.recv_into(view)
+
+        if received == 0:
+            raise ConnectionError(f"Connection closed {len(view)} bytes short!")
+
+        view = view[received:]
+
+    return bytes(data)
+
+
+class Rendezvous:
+    #   Where philosophers that connect over TCP meet. It only hands out the
+    #   identifiers and addresses, after which the philosophers connect to each
+    #   other directly and the rendezvous is no longer needed. Identifiers that
+    #   were asked for are given first, the rest in the order of arrival.
+
+    def __init__(self, count: int, host: str = None, port: int = None):
+        self._count = count
+        self._socket = socket.create_server(("127.0.0.1" if host is None else host, 0 if port is None else port),
+                                            backlog=count)
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def address(self):
+        return self._socket.getsockname()[:2]
+
+    def serve(self):
+        connections = [self._socket.accept()[0] for _ in range(self.count)]
+        joins = [_join_request.unpack(_receive_exactly(connection, _join_request.size))
+                 for connection in connections]
+
+        requested = [identifier for identifier, _ in joins if identifier != -1]
+
+        if len(set(requested)) != len(requested) or any(not 0 <= x < self.count for x in requested):
+            raise ValueError(f"Identifiers {requested} can't be given to {self.count} philosophers!")
+
+        free = iter(sorted(set(range(self.count)) - set(requested)))
+        identifiers = [next(free) if identifier == -1 else identifier for identifier, _ in joins]
+
+        addresses = [None] * self.count
+
+        for identifier, connection, (_, port) in zip(identifiers, connections, joins):
+            addresses[identifier] = _address.pack(bytes(connection.getpeername()[0], encoding="utf8"), port)
+
+        for identifier, connection in zip(identifiers, connections):
+            connection.sendall(_welcome.pack(identifier, self.count) + b"".join(addresses))
+            connection.close()
+
+    def close(self):
+        self._socket.close()
+
+
+def _join(address, identifier: int = None):
+    #   We listen on the interface we reached the rendezvous through, so the
+    #   address it sees us at is also where the others can reach us. Everyone
+    #   connects to those before them and waits for the ones after them to
+    #   connect, so every two philosophers share exactly one connection.
+    rendezvous = socket.create_connection(address)
+    listener = socket.create_server((rendezvous.getsockname()[0], 0), backlog=socket.SOMAXCONN)
+
+    rendezvous.sendall(_join_request.pack(-1 if identifier is None else identifier, listener.getsockname()[1]))
+    identifier, count = _welcome.unpack(_receive_exactly(rendezvous, _welcome.size))
+    table = _receive_exactly(rendezvous, count * _address.size)
+    rendezvous.close()
+
+    sockets = dict()
+
+    for peer in range(identifier):
+        host, port = _address.unpack_from(table, peer * _address.size)
+        sockets[peer] = socket.create_connection((str(host.rstrip(b"\0"), encoding="utf8"), port))
+        sockets[peer].sendall(_handshake.pack(identifier))
+
+    for _ in range(identifier + 1, count):
+        connection, _ = listener.accept()
+        sockets[_handshake.unpack(_receive_exactly(connection, _handshake.size))[0]] = connection
+
+    listener.close()
+
+    for connection in sockets.values():
+        #   Messages are already batched until flush, so there's nothing to gain
+        #   from the kernel holding them back as well.
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    return identifier, count, sockets
+
+
+class _SocketEndpoint(_MeshEndpoint):
+    #   Same as the mesh, only over a socket per peer, each both read from and
+    #   written to. Made in the parent, it joins on first use, which is in the
+    #   philosopher's own process.
+
+    def __init__(self, identifier: int, count: int, address):
+        super().__init__(identifier, count)
+
+        self._address = address
+        self._sockets = None
+
+    def _attach(self, sockets):
+        self._sockets = sockets
+
+        for peer, connection in sockets.items():
+            self.connect(peer, connection.fileno(), connection.fileno())
+
+    def _ensure_joined(self):
+        if self._sockets is None:
+            self._attach(_join(self._address, self.identifier)[2])
+
+    def send(self, payload: bytes, destination: int = None):
+        self._ensure_joined()
+        super().send(payload, destination)
+
+    def receive(self, timeout: float = None):
+        self._ensure_joined()
+
+        return super().receive(timeout)
+
+    def _write(self, peer: int, data: bytes):
+        if self._writers[peer] is None:
+            return
+
+        try:
+            super()._write(peer, data)
+        except (BrokenPipeError, ConnectionResetError):
+            #   A peer only leaves once it's done, so whatever we'd tell it no
+            #   longer matters.
+            self._writers[peer] = None
+
+
+def join(host: str, port: int, identifier: int = None) -> Endpoint:
+    #   Joins philosophers through the rendezvous at host:port, from anywhere.
+    #   Returns once everyone has joined and is connected.
+    identifier, count, sockets = _join((host, port), identifier)
+
+    endpoint = _SocketEndpoint(identifier, count, (host, port))
+    endpoint._attach(sockets)
+
+    return endpoint
+
+
+class TcpTransport(Transport):
+    #   Philosophers connected over TCP, each pair by its own connection, which
+    #   needs a linear number of file descriptors per philosopher. Here the
+    #   rendezvous runs in a thread of the parent, on the loopback interface by
+    #   default, but philosophers on other machines can join just the same,
+    #   see join and node.py.
+
+    def __init__(self, host: str = None, port: int = None):
+        super().__init__()
+
+        self._transport_id = "tcp"
+        self._host = host
+        self._port = port
+        self._rendezvous = None
+        self._thread = None
+
+    def open(self, count: int):
+        self._rendezvous = Rendezvous(count, self._host, self._port)
+        self._thread = threading.Thread(target=self._rendezvous.serve, name="rendezvous", daemon=True)
+        self._thread.start()
+
+        return [_SocketEndpoint(i, count, self._rendezvous.address) for i in range(count)]
+
+    def close(self):
+        self._thread.join()
+        self._rendezvous.close()
+# endregion
+
+
+name_to_transport = \
+    {
+        "mesh": MeshTransport,
+        "hub": HubTransport,
+        "shm": ShmTransport,
+        "tcp": TcpTransport
+    }
+
+
+def get_transport(transport: Transport or str = None):
+    if transport is None:
+        return MeshTransport()
+
+    if isinstance(transport, Transport):
+        return transport
+
+    if transport not in name_to_transport:
+        raise ValueError(f"Transport \"{transport}\" is not a valid identifier!")
+
+    return name_to_transport[transport]()
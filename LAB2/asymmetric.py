@@ -19,6 +19,15 @@ from typing import Dict
 from Crypto.Cipher import PKCS1_OAEP
 from Crypto.PublicKey import RSA as _RSA
 from Crypto.Signature import pkcs1_15
+from Crypto.Util.asn1 import DerNull, DerObjectId, DerOctetString, DerSequence
+
+
+def digest_info_length(message_hash):
+    #   PKCS#1 v1.5 signs the digest along with the OID of the hash, and that
+    #   has to fit into the modulus with 11 bytes to spare.
+    algorithm = DerSequence([DerObjectId(message_hash.oid).encode(), DerNull().encode()])
+
+    return len(DerSequence([algorithm.encode(), DerOctetString(bytes(message_hash.digest_size)).encode()]).encode())
 
 
 class RSA:
@@ -0,0 +1,344 @@
+#   Copyright 2020 Miljenko Šuflaj
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+#   Run from the root of the lab (where the notebook is), for example:
+#
+#       python benchmark.py many
+
+import argparse
+import os
+import tempfile
+from time import perf_counter
+from typing import Dict, List
+
+from asymmetric import RSA
+from components import Seal, Signature, get_hash
+from hashes import DigestCache, SHA2, TreeHash
+from symmetric import AES, DES3
+
+
+def print_table(rows: List[Dict]):
+    if len(rows) == 0:
+        return
+
+    columns = list(rows[0].keys())
+    cells = [[f"{x:.2f}" if isinstance(x, float) else str(x) for x in row.values()] for row in rows]
+    widths = [max(len(column), *(len(x[i]) for x in cells)) for i, column in enumerate(columns)]
+
+    print("  ".join(column.rjust(width) for column, width in zip(columns, widths)))
+
+    for row in cells:
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+
+def symmetric_many(payload_sizes=(16, 64, 256), n_records: int = 10000, methods=("aes", "3des"),
+                   cipher_modes=("cbc", "ctr")):
+    #   Records encrypted one by one (a cipher, and so an expanded key, for
+    #   every one of them) against all of them at once with encrypt_many.
+    results = list()
+
+    for method in methods:
+        for cipher_mode in cipher_modes:
+            #   The authenticated modes only work with AES, and the rest of the
+            #   methods are left out of them.
+            try:
+                key = AES(cipher_mode=cipher_mode) if method == "aes" else DES3(cipher_mode=cipher_mode)
+            except ValueError:
+                continue
+
+            for payload_size in payload_sizes:
+                records = [os.urandom(payload_size) for _ in range(n_records)]
+
+                start = perf_counter()
+
+                for record in records:
+                    key.encrypt(record, raw=True)
+
+                one_by_one = perf_counter() - start
+                start = perf_counter()
+
+                data, offsets = key.encrypt_many(records)
+
+                many = perf_counter() - start
+                start = perf_counter()
+
+                key.decrypt_many(data, offsets)
+
+                many_decrypt = perf_counter() - start
+
+                results.append({"method": method,
+                                "mode": cipher_mode,
+                                "bytes": payload_size,
+                                "one_by_one_per_s": n_records / one_by_one,
+                                "many_per_s": n_records / many,
+                                "many_decrypt_per_s": n_records / many_decrypt})
+
+    return results
+
+
+def symmetric_parallel(worker_counts=(1, 2, 4), size: int = 64 << 20, repeats: int = 3):
+    #   Encrypting in CTR mode and decrypting in CBC mode, the two that can be
+    #   split up one way or the other, on a single large payload.
+    results = list()
+    data = os.urandom(size)
+
+    for cipher_mode, direction in (("ctr", "encrypt"), ("cbc", "decrypt"), ("ctr", "decrypt")):
+        key = AES(cipher_mode=cipher_mode)
+        encrypted = bytearray(key.encrypted_length(size))
+        key.encrypt_into(data, encrypted)
+        output = bytearray(len(encrypted))
+
+        for workers in worker_counts:
+            start = perf_counter()
+
+            for _ in range(repeats):
+                if direction == "encrypt":
+                    key.encrypt_into(data, output, workers=workers)
+                else:
+                    key.decrypt_into(encrypted, output, workers=workers)
+
+            elapsed = (perf_counter() - start) / repeats
+
+            results.append({"mode": cipher_mode,
+                            "direction": direction,
+                            "workers": workers,
+                            "mb_per_s": size / elapsed / (1 << 20)})
+
+    return results
+
+
+def seal_throughput(cipher_modes=("cbc", "gcm", "eax", "ocb"), size: int = 16 << 20, repeats: int = 3):
+    #   Sealing and opening a large message, where the authenticated modes
+    #   only sign the nonce and the tag instead of hashing all of it.
+    results = list()
+    message = os.urandom(size)
+    secret_key_cipher, signature_cipher = RSA(), RSA()
+
+    for cipher_mode in cipher_modes:
+        seal = Seal(AES(cipher_mode=cipher_mode), secret_key_cipher, SHA2(256), signature_cipher)
+
+        start = perf_counter()
+
+        for _ in range(repeats):
+            content = seal.seal_to_dict(message)
+
+        sealing = (perf_counter() - start) / repeats
+        start = perf_counter()
+
+        for _ in range(repeats):
+            Seal.open_from_dict(content, secret_key_cipher, signature_cipher)
+
+        opening = (perf_counter() - start) / repeats
+
+        results.append({"mode": cipher_mode,
+                        "seal_mb_per_s": size / sealing / (1 << 20),
+                        "open_mb_per_s": size / opening / (1 << 20)})
+
+    return results
+
+
+def hash_files(methods=("sha2", "sha3"), key_lengths=(224, 256, 384, 512), size: int = 256 << 20,
+               repeats: int = 3):
+    #   A file that's in the page cache, hashed through a memory map and by
+    #   reading it into the same buffer over and over.
+    results = list()
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = os.path.join(directory, "data")
+
+        with open(file_path, mode="wb") as file:
+            for _ in range(size >> 20):
+                file.write(os.urandom(1 << 20))
+
+        for method in methods:
+            for key_length in key_lengths:
+                #   Not every hash comes in every length, and those that don't are
+                #   left out.
+                try:
+                    get_hash(method, key_length)
+                except ValueError:
+                    continue
+
+                row = {"method": method, "bits": key_length}
+
+                for memory_map in (True, False):
+                    start = perf_counter()
+
+                    for _ in range(repeats):
+                        get_hash(method, key_length).hash_file(file_path, memory_map=memory_map)
+
+                    elapsed = (perf_counter() - start) / repeats
+                    row["mmap_gb_per_s" if memory_map else "readinto_gb_per_s"] = size / elapsed / (1 << 30)
+
+                results.append(row)
+
+    return results
+
+
+def tree_hash(worker_counts=(1, 2, 4), key_length: int = 256, size: int = 256 << 20, leaf_size: int = 1 << 20):
+    #   A file hashed as it is, as a tree with its leaves hashed by a number
+    #   of processes, and then hashed again once one of its leaves changed.
+    results = list()
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = os.path.join(directory, "data")
+
+        with open(file_path, mode="wb") as file:
+            for _ in range(size >> 20):
+                file.write(os.urandom(1 << 20))
+
+        start = perf_counter()
+        SHA2(key_length).hash_file(file_path)
+        results.append({"hash": "sha2", "workers": 1, "gb_per_s": size / (perf_counter() - start) / (1 << 30),
+                        "rehash_ms": float("nan")})
+
+        for workers in worker_counts:
+            tree = TreeHash(SHA2, key_length=key_length, leaf_size=leaf_size, workers=workers)
+
+            start = perf_counter()
+            tree.hash_file(file_path)
+            elapsed = perf_counter() - start
+
+            with open(file_path, mode="r+b") as file:
+                file.seek(size // 2)
+                file.write(os.urandom(16))
+
+            start = perf_counter()
+            tree.rehash_file(file_path, [(size // 2, 16)])
+            rehash = perf_counter() - start
+
+            results.append({"hash": tree.method_id,
+                            "workers": workers,
+                            "gb_per_s": size / elapsed / (1 << 30),
+                            "rehash_ms": rehash * 1e3})
+
+    return results
+
+
+def digest_cache(size: int = 256 << 20, repeats: int = 10):
+    #   A signed file verified over and over, hashing it every time and with
+    #   its digest cached. The file was only just written, which would keep it
+    #   out of the cache for a while (see DigestCache), so that's turned off.
+    results = list()
+    signature_cipher = RSA()
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = os.path.join(directory, "data")
+
+        with open(file_path, mode="wb") as file:
+            for _ in range(size >> 20):
+                file.write(os.urandom(1 << 20))
+
+        content = Signature(SHA2(256), signature_cipher).sign_file_to_dict(file_path)
+
+        for cached in (False, True):
+            cache = DigestCache(os.path.join(directory, "index"), racy_window=0.) if cached else None
+
+            start = perf_counter()
+
+            for _ in range(repeats):
+                Signature.verify_from_dict(content, signature_cipher, cache=cache)
+
+            elapsed = perf_counter() - start
+
+            results.append({"cache": cached,
+                            "ms_per_verify": elapsed / repeats * 1e3,
+                            "hits": 0 if cache is None else cache.hits,
+                            "misses": repeats if cache is None else cache.misses})
+
+    return results
+
+
+def hash_methods(methods=(("sha2", (256, 512)), ("sha3", (256, 512)), ("blake2b", (256, 512)),
+                           ("blake2s", (128, 256)), ("shake128", (256,)), ("shake256", (512,))),
+                 size: int = 64 << 20, repeats: int = 3):
+    #   Every algorithm (and digest length) hashing the same message in memory.
+    results = list()
+    message = os.urandom(size)
+
+    for method, key_lengths in methods:
+        for key_length in key_lengths:
+            start = perf_counter()
+
+            for _ in range(repeats):
+                get_hash(method, key_length).hash_now(message)
+
+            elapsed = (perf_counter() - start) / repeats
+
+            results.append({"method": method,
+                            "bits": key_length,
+                            "mb_per_s": size / elapsed / (1 << 20)})
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NOS LAB2 benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    many_parser = subparsers.add_parser("many", help="small records encrypted per second, one by one vs all at once")
+    many_parser.add_argument("--sizes", type=int, nargs="+", default=[16, 64, 256])
+    many_parser.add_argument("--records", type=int, default=10000)
+    many_parser.add_argument("--methods", nargs="+", choices=["aes", "3des"], default=["aes", "3des"])
+    many_parser.add_argument("--modes", nargs="+", choices=["ecb", "cbc", "ofb", "cfb", "ctr", "gcm", "eax", "ocb"],
+                             default=["cbc", "ctr"])
+
+    parallel_parser = subparsers.add_parser("parallel", help="MB/s of a large payload as workers are added")
+    parallel_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parallel_parser.add_argument("--size", type=int, default=64, help="in MiB")
+
+    seal_parser = subparsers.add_parser("seal", help="MB/s of sealing and opening, hashed vs authenticated modes")
+    seal_parser.add_argument("--modes", nargs="+", choices=["ecb", "cbc", "ofb", "cfb", "ctr", "gcm", "eax", "ocb"],
+                             default=["cbc", "gcm", "eax", "ocb"])
+    seal_parser.add_argument("--size", type=int, default=16, help="in MiB")
+
+    hash_parser = subparsers.add_parser("hash", help="GB/s of hashing a file, memory mapped vs read into a buffer")
+    hash_parser.add_argument("--methods", nargs="+", default=["sha2", "sha3"],
+                             choices=["sha2", "sha3", "blake2b", "blake2s", "shake128", "shake256"])
+    hash_parser.add_argument("--bits", type=int, nargs="+", default=[224, 256, 384, 512])
+    hash_parser.add_argument("--size", type=int, default=256, help="in MiB")
+
+    tree_parser = subparsers.add_parser("tree", help="GB/s of a tree hash as workers are added, and rehashing a leaf")
+    tree_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    tree_parser.add_argument("--size", type=int, default=256, help="in MiB")
+    tree_parser.add_argument("--leaf-size", type=int, default=1024, help="in KiB")
+
+    cache_parser = subparsers.add_parser("cache", help="verifying a signed file over and over, with or without a cache")
+    cache_parser.add_argument("--size", type=int, default=256, help="in MiB")
+    cache_parser.add_argument("--repeats", type=int, default=10)
+
+    hashes_parser = subparsers.add_parser("hashes", help="MB/s of every hash algorithm and digest length")
+    hashes_parser.add_argument("--size", type=int, default=64, help="in MiB")
+
+    args = parser.parse_args()
+
+    if args.benchmark == "many":
+        print_table(symmetric_many(payload_sizes=args.sizes, n_records=args.records, methods=args.methods,
+                                   cipher_modes=args.modes))
+    elif args.benchmark == "parallel":
+        print_table(symmetric_parallel(worker_counts=args.workers, size=args.size << 20))
+    elif args.benchmark == "seal":
+        print_table(seal_throughput(cipher_modes=args.modes, size=args.size << 20))
+    elif args.benchmark == "hash":
+        print_table(hash_files(methods=args.methods, key_lengths=args.bits, size=args.size << 20))
+    elif args.benchmark == "tree":
+        print_table(tree_hash(worker_counts=args.workers, size=args.size << 20, leaf_size=args.leaf_size << 10))
+    elif args.benchmark == "cache":
+        print_table(digest_cache(size=args.size << 20, repeats=args.repeats))
+    elif args.benchmark == "hashes":
+        print_table(hash_methods(size=args.size << 20))
+
+
+if __name__ == "__main__":
+    main()
@@ -16,13 +16,13 @@ import json
 import os
 from typing import Dict
 
-from symmetric import Symmetric, AES, DES3
-from asymmetric import RSA
-from hashes import Hash, SHA2, SHA3
+from symmetric import Symmetric, AES, DES3, authenticated_mode_to_nonce_length, read_authenticated_header
+from asymmetric import RSA, digest_info_length
+from hashes import BLAKE2b, BLAKE2s, DigestCache, Hash, SHA2, SHA3, SHAKE128, SHAKE256, TreeHash
 
 message_methods = {"3des", "aes", "rsa"}
 secret_key_methods = {"rsa"}
-hash_methods = {"sha2", "sha3"}
+hash_methods = {"sha2", "sha3", "blake2b", "blake2s", "shake128", "shake256"}
 
 method_to_class = \
     {
@@ -30,10 +30,42 @@ method_to_class = \
         "aes": AES,
         "rsa": RSA,
         "sha2": SHA2,
-        "sha3": SHA3
+        "sha3": SHA3,
+        "blake2b": BLAKE2b,
+        "blake2s": BLAKE2s,
+        "shake128": SHAKE128,
+        "shake256": SHAKE256
     }
 
 
+def get_hash(method_id: str, key_length: int):
+    #   Tree hashes are named after the hash they're made of and the size of
+    #   their leaves, e.g. "tree-sha2-1048576", see TreeHash.
+    if method_id.startswith("tree-"):
+        _, hash_method, leaf_size = method_id.split("-")
+
+        if hash_method not in hash_methods:
+            raise ValueError(f"Method \"{method_id}\" is not a valid identifier!")
+
+        return TreeHash(method_to_class[hash_method], key_length=key_length, leaf_size=int(leaf_size))
+
+    if method_id not in hash_methods:
+        raise ValueError(f"Method \"{method_id}\" is not a valid identifier!")
+
+    return method_to_class[method_id](key_length=key_length)
+
+
+def hash_file(hash_instance: Hash, file_path: str, cache: DigestCache = None):
+    #   Returns the hash object of the file, which isn't hashed if its digest
+    #   is in the cache.
+    if cache is not None:
+        return cache.hash_file(hash_instance, file_path)
+
+    hash_instance.hash_file(file_path)
+
+    return hash_instance.hash
+
+
 class Envelope:
     def __init__(self, message_cipher: Symmetric, secret_key_cipher: RSA):
         if not isinstance(message_cipher, Symmetric):
@@ -94,7 +126,10 @@ class Envelope:
     @staticmethod
     def read(content: Dict):
         n_content = dict(content)
-        n_content["init_vector"] = bytes.fromhex(content["init_vector"])
+
+        if "init_vector" in content:
+            n_content["init_vector"] = bytes.fromhex(content["init_vector"])
+
         n_content["encrypted_data"] = content["encrypted_data"].encode("utf8")
         n_content["encrypted_key"] = bytes.fromhex(content["encrypted_key"])
 
@@ -150,10 +185,14 @@ class Signature:
         if not (isinstance(signature_cipher, RSA)):
             raise TypeError(f"Signature cipher can't be of class {type(signature_cipher)}!")
 
+        if digest_info_length(hash_cipher.hash) + 11 > signature_cipher.key.size_in_bytes():
+            raise ValueError(f"A {hash_cipher.key_length}-bit {hash_cipher.method_id} digest doesn't fit into a "
+                             f"{signature_cipher.key.size_in_bits()}-bit RSA signature!")
+
         self._hash_method_id = hash_cipher.method_id
         self._hash_key_length = hash_cipher.key_length
 
-        self._hash_class = method_to_class[self._hash_method_id]
+        self._hash_class = type(hash_cipher)
         self._signature_cipher = signature_cipher
 
     # region Properties
@@ -177,12 +216,18 @@ class Signature:
     def sign(self, message: str or bytes, **kwargs):
         data = message.encode("utf8") if isinstance(message, str) else message
 
-        hash_instance = self.hash_class(key_length=self.hash_key_length)
+        hash_instance = get_hash(self.hash_method_id, self.hash_key_length)
         hash_instance.update(message=data)
         signature = self.signature_cipher.sign(message_hash=hash_instance.hash, **kwargs)
 
         return data, signature
 
+    def sign_file(self, file_path: str, cache: DigestCache = None, **kwargs):
+        #   Signs a file without it ever being in memory, see Hash.hash_file.
+        hash_instance = get_hash(self.hash_method_id, self.hash_key_length)
+
+        return self.signature_cipher.sign(message_hash=hash_file(hash_instance, file_path, cache), **kwargs)
+
     @staticmethod
     def verify(message_hash, signature: bytes, signature_cipher: RSA or str):
         if not isinstance(signature_cipher, RSA):
@@ -193,7 +238,7 @@ class Signature:
         return signature_cipher.verify(message_hash=message_hash, signature=signature)
 
     def self_verify(self, message: str or bytes, signature: bytes):
-        hash_instance = self.hash_class(key_length=self.hash_key_length)
+        hash_instance = get_hash(self.hash_method_id, self.hash_key_length)
         hash_instance.update(message=message)
 
         return Signature.verify(message_hash=hash_instance.hash,
@@ -201,9 +246,7 @@ class Signature:
                                 signature_cipher=self.signature_cipher)
 
     # region Serialization
-    def sign_to_dict(self, message: str, **kwargs):
-        data, signature = self.sign(message=message, **kwargs)
-
+    def _describe(self):
         return {"desc": "Signature",
                 "method":
                     {
@@ -214,10 +257,21 @@ class Signature:
                     {
                         "hash": self.hash_key_length,
                         "signature": self.signature_cipher.key.size_in_bits()
-                    },
+                    }}
+
+    def sign_to_dict(self, message: str, **kwargs):
+        data, signature = self.sign(message=message, **kwargs)
+
+        return {**self._describe(),
                 "data": data.hex(),
                 "signature": signature.hex()}
 
+    def sign_file_to_dict(self, file_path: str, cache: DigestCache = None, **kwargs):
+        #   Instead of the data, there's the path of the file that was signed.
+        return {**self._describe(),
+                "file": file_path,
+                "signature": self.sign_file(file_path=file_path, cache=cache, **kwargs).hex()}
+
     def sign_to_file(self, message: str, dest_folder_path: str = "", **kwargs):
         with open(os.path.join(dest_folder_path, "signature.json"), mode="w+") as file:
             json.dump(self.sign_to_dict(message=message, **kwargs), file, ensure_ascii=False, sort_keys=False, indent=2)
@@ -225,34 +279,40 @@ class Signature:
     @staticmethod
     def read(content: Dict):
         n_content = dict(content)
-        n_content["data"] = bytes.fromhex(content["data"])
         n_content["signature"] = bytes.fromhex(content["signature"])
 
+        if "data" in content:
+            n_content["data"] = bytes.fromhex(content["data"])
+
         return n_content
 
     @staticmethod
-    def verify_from_dict(content, signature_cipher: RSA or str):
+    def verify_from_dict(content, signature_cipher: RSA or str, cache: DigestCache = None):
         content = Signature.read(content=content)
 
         hash_method = content["method"]["hash"]
         hash_key_length = content["key_length"]["hash"]
-        data = content["data"]
         signature = content["signature"]
 
-        hash_cipher = method_to_class[hash_method](key_length=hash_key_length)
-        hash_cipher.update(message=data)
+        hash_cipher = get_hash(hash_method, hash_key_length)
+
+        if "file" in content:
+            message_hash = hash_file(hash_cipher, content["file"], cache)
+        else:
+            hash_cipher.update(message=content["data"])
+            message_hash = hash_cipher.hash
 
-        return Signature.verify(message_hash=hash_cipher.hash,
+        return Signature.verify(message_hash=message_hash,
                                 signature=signature,
                                 signature_cipher=signature_cipher)
 
     @staticmethod
-    def verify_from_file(file_path: str, signature_cipher: RSA or str):
+    def verify_from_file(file_path: str, signature_cipher: RSA or str, cache: DigestCache = None):
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"File \"{file_path}\" doesn't exist!")
 
         with open(file_path) as file:
-            return Signature.verify_from_dict(content=json.load(file), signature_cipher=signature_cipher)
+            return Signature.verify_from_dict(content=json.load(file), signature_cipher=signature_cipher, cache=cache)
     # endregion
 
 
@@ -280,10 +340,22 @@ class Seal:
         return self._signature
     # endregion
 
+    @staticmethod
+    def _signed_part(cipher_mode: str, encoded_message: bytes, encoded_secret_key: bytes):
+        #   In an authenticated mode, the message is already vouched for by its
+        #   tag, so only the nonce and the tag are signed (along with the key),
+        #   instead of hashing all of the message again. The tag only holds up
+        #   against those without the key, which the signature is there for.
+        if cipher_mode in authenticated_mode_to_nonce_length:
+            encoded_message = read_authenticated_header(encoded_message, cipher_mode)
+
+        return encoded_message + encoded_secret_key
+
     def seal(self, message: str or bytes, **kwargs):
         encoded_message, encoded_secret_key = self.envelope.envelop(message=message, **kwargs)
 
-        _, signature = self.signature.sign(message=encoded_message + encoded_secret_key, **kwargs)
+        _, signature = self.signature.sign(message=self._signed_part(self.envelope.message_cipher.cipher_mode,
+                                                                     encoded_message, encoded_secret_key), **kwargs)
 
         return encoded_message, encoded_secret_key, signature
 
@@ -326,7 +398,10 @@ class Seal:
     @staticmethod
     def read(content: Dict):
         n_content = dict(content)
-        n_content["init_vector"] = bytes.fromhex(content["init_vector"])
+
+        if "init_vector" in content:
+            n_content["init_vector"] = bytes.fromhex(content["init_vector"])
+
         n_content["encrypted_data"] = content["encrypted_data"].encode("utf8")
         n_content["encrypted_key"] = bytes.fromhex(content["encrypted_key"])
         n_content["signature"] = bytes.fromhex(content["signature"])
@@ -349,10 +424,11 @@ class Seal:
         signature = content["signature"]
 
         # region Check signature
-        hash_cipher = method_to_class[hash_method](key_length=hash_key_length)
+        hash_cipher = get_hash(hash_method, hash_key_length)
         signature_cipher = Signature(hash_cipher=hash_cipher, signature_cipher=signature_cipher)
 
-        if not signature_cipher.self_verify(message=encrypted_data + encrypted_key, signature=signature):
+        if not signature_cipher.self_verify(message=Seal._signed_part(cipher_mode, encrypted_data, encrypted_key),
+                                            signature=signature):
             raise ValueError(f"Signature check failed!")
         # endregion
 
@@ -12,8 +12,34 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import mmap
+import os
+import struct
+import time
+from typing import List, Tuple
+
+from Crypto.Hash import BLAKE2b as _BLAKE2b
+from Crypto.Hash import BLAKE2s as _BLAKE2s
 from Crypto.Hash import SHA224, SHA256, SHA384, SHA512
 from Crypto.Hash import SHA3_224, SHA3_256, SHA3_384, SHA3_512
+from Crypto.Hash import SHAKE128 as _SHAKE128
+from Crypto.Hash import SHAKE256 as _SHAKE256
+
+
+#   The index of a DigestCache: a header with the number of entries, and then
+#   every entry, from the least recently used one on. An entry is the size,
+#   mtime, inode and hash length, followed by the lengths and the bytes of the
+#   path, the hash method and the digest.
+_index_header = struct.Struct("<4sI")
+_index_entry = struct.Struct("<QqQIHHI")
+_index_magic = b"NOS2"
+
+#   A TreeHash only starts a process pool for at least this many bytes of
+#   leaves. Starting one takes about 20 ms, about as long as hashing 14 MiB
+#   with SHA-256, so on two cores it's only a gain from around 32 MiB on.
+min_parallel_length = 64 << 20
 
 
 class Hash:
@@ -44,6 +70,57 @@ class Hash:
 
         return self.hash.digest()
 
+    def hash_stream(self, source, chunk_size: int = None):
+        #   Hashes whatever the source streams, the same way hash_now hashes a
+        #   message. Anything that reads into a buffer is read into the same
+        #   one (of 1 MiB, unless told otherwise) every time.
+        chunk_size = (1 << 20) if chunk_size is None else chunk_size
+
+        if hasattr(source, "readinto"):
+            buffer = memoryview(bytearray(chunk_size))
+
+            while True:
+                length = source.readinto(buffer)
+
+                if not length:
+                    break
+
+                self.update(buffer[:length])
+        elif hasattr(source, "read"):
+            #   Text streams end on "" rather than b"", so anything empty will do.
+            while True:
+                chunk = source.read(chunk_size)
+
+                if not chunk:
+                    break
+
+                self.update(chunk)
+        else:
+            for chunk in source:
+                self.update(chunk)
+
+        return self.hash.digest()
+
+    def hash_file(self, file_path: str, chunk_size: int = None, memory_map: bool = True):
+        #   Memory maps the file (unless told not to), so it's hashed straight
+        #   out of the page cache, without being read into a buffer at all.
+        #   Empty files can't be mapped, but there's nothing to read anyway.
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File \"{file_path}\" doesn't exist!")
+
+        with open(file_path, mode="rb", buffering=0) as file:
+            if not memory_map or os.fstat(file.fileno()).st_size == 0:
+                return self.hash_stream(file, chunk_size)
+
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if hasattr(mapped, "madvise"):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+
+                with memoryview(mapped) as view:
+                    self.update(view)
+
+        return self.hash.digest()
+
 
 class SHA2(Hash):
     __key_to_instance =\
@@ -83,3 +160,431 @@ class SHA3(Hash):
             raise ValueError(f"Key length of {key_length} is not valid!")
 
         self._hash = self._class.new(update_after_digest=True)
+
+
+class BLAKE2(Hash):
+    #   BLAKE2b and BLAKE2s can be of any length, but only these have an OID,
+    #   which it takes to sign them.
+    def __init__(self, method_id: str, key_length: int, hash_class, key_lengths):
+        super().__init__(method_id, key_length)
+
+        if key_length not in key_lengths:
+            raise ValueError(f"Key length of {key_length} is not valid!")
+
+        self._class = hash_class
+        self._hash = self._class.new(digest_bits=key_length, update_after_digest=True)
+
+
+class BLAKE2b(BLAKE2):
+    def __init__(self, key_length: int = 512):
+        super().__init__("blake2b", key_length, _BLAKE2b, (160, 256, 384, 512))
+
+
+class BLAKE2s(BLAKE2):
+    def __init__(self, key_length: int = 256):
+        super().__init__("blake2s", key_length, _BLAKE2s, (128, 160, 224, 256))
+
+
+class _ShakeHash:
+    #   SHAKE can be read for as long as it takes, but only once, and after
+    #   that it can't be updated. Reading a copy of it instead makes it work
+    #   like any other hash object, with a digest of the given length.
+    def __init__(self, xof, digest_size: int):
+        self._xof = xof
+        self.oid = xof.oid
+        self.digest_size = digest_size
+
+    def update(self, data):
+        self._xof.update(data)
+
+        return self
+
+    def digest(self):
+        return self._xof.copy().read(self.digest_size)
+
+    def hexdigest(self):
+        return self.digest().hex()
+
+
+class SHAKE(Hash):
+    def __init__(self, method_id: str, key_length: int, hash_class):
+        super().__init__(method_id, key_length)
+
+        if key_length <= 0 or key_length % 8 != 0:
+            raise ValueError(f"Key length of {key_length} is not valid!")
+
+        self._class = hash_class
+        self._hash = _ShakeHash(self._class.new(), key_length // 8)
+
+
+class SHAKE128(SHAKE):
+    def __init__(self, key_length: int = 256):
+        super().__init__("shake128", key_length, _SHAKE128)
+
+
+class SHAKE256(SHAKE):
+    def __init__(self, key_length: int = 512):
+        super().__init__("shake256", key_length, _SHAKE256)
+
+
+def _hash_leaves(hash_class, key_length: int, file_path: str, leaf_size: int, start: int, stop: int):
+    #   Hashes the leaves from start up to stop, in a process of its own, out
+    #   of its own memory map of the file, so only their digests come back.
+    with open(file_path, mode="rb", buffering=0) as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as view:
+                return [TreeHash.hash_leaf(hash_class, key_length, view[i * leaf_size:(i + 1) * leaf_size])
+                        for i in range(start, stop)]
+
+
+class TreeHash(Hash):
+    #   A Merkle tree of some other hash: the data is split into leaves of the
+    #   same size (the last one can be shorter), which are hashed on their own,
+    #   and then every two nodes are hashed together into one, until there's
+    #   only the root left. Leaves and nodes are prefixed with a different byte
+    #   (the same as in RFC 6962), so one can't pass for the other. Leaves can
+    #   be hashed in any order, so hash_file hashes them in a process pool,
+    #   and rehash_file only hashes the ones that changed.
+    #
+    #   The method identifier says which hash it's made of, and how large the
+    #   leaves are, e.g. "tree-sha2-1048576", so that's all it takes to hash the
+    #   same way again (see components.get_hash).
+
+    def __init__(self, hash_class=None, key_length: int = 256, leaf_size: int = None, workers: int = None):
+        hash_class = SHA2 if hash_class is None else hash_class
+        leaf_size = (1 << 20) if leaf_size is None else leaf_size
+
+        if leaf_size <= 0:
+            raise ValueError(f"Leaf size of {leaf_size} is not valid!")
+
+        super().__init__(f"tree-{hash_class(key_length).method_id}-{leaf_size}", key_length)
+
+        self._hash_class = hash_class
+        self._leaf_size = leaf_size
+        self._workers = os.cpu_count() if workers is None else workers
+
+        self._leaves = list()
+        self._pending = bytearray()
+
+    # region Properties
+    @property
+    def hash_class(self):
+        return self._hash_class
+
+    @property
+    def leaf_size(self):
+        return self._leaf_size
+
+    @property
+    def workers(self):
+        return self._workers
+
+    @property
+    def leaves(self):
+        return self._leaves
+
+    @property
+    def hash(self):
+        #   The hash of the root, as it is right now. Whatever doesn't fill a
+        #   leaf yet is hashed as the last leaf, but stays pending, so there can
+        #   be more of it.
+        leaves = self._leaves
+
+        if len(self._pending) != 0 or len(leaves) == 0:
+            leaves = leaves + [self.hash_leaf(self.hash_class, self.key_length, self._pending)]
+
+        return self._get_root(leaves)
+    # endregion
+
+    @staticmethod
+    def hash_leaf(hash_class, key_length: int, data):
+        leaf = hash_class(key_length)
+        leaf.update(b"\x00")
+        leaf.update(data)
+
+        return leaf.hash.digest()
+
+    def _get_root(self, leaves: List[bytes]):
+        #   Returns the hash object of the root, not just its digest, since
+        #   that's what gets signed. Every level pairs up its nodes (an odd one
+        #   out is carried up a level), until there are two, or just one, left
+        #   to hash into the root.
+        while len(leaves) > 2:
+            leaves = [self.hash_class(self.key_length).hash_now(b"\x01" + b"".join(leaves[i:i + 2]))
+                      if i + 1 < len(leaves) else leaves[i]
+                      for i in range(0, len(leaves), 2)]
+
+        root = self.hash_class(self.key_length)
+        root.update(b"\x01" + b"".join(leaves))
+
+        return root.hash
+
+    def update(self, message: str or bytes):
+        #   Only a leaf that isn't full yet is kept, the rest are hashed as soon
+        #   as they're full.
+        view = memoryview(message.encode("utf8") if isinstance(message, str) else message).cast("B")
+
+        if len(self._pending) != 0:
+            taken = min(self.leaf_size - len(self._pending), len(view))
+            self._pending += view[:taken]
+            view = view[taken:]
+
+            if len(self._pending) < self.leaf_size:
+                return
+
+            self._leaves.append(self.hash_leaf(self.hash_class, self.key_length, self._pending))
+            self._pending = bytearray()
+
+        full = len(view) - len(view) % self.leaf_size
+
+        for i in range(0, full, self.leaf_size):
+            self._leaves.append(self.hash_leaf(self.hash_class, self.key_length, view[i:i + self.leaf_size]))
+
+        self._pending += view[full:]
+
+    def _hash_file_leaves(self, file_path: str, indices: List[int]):
+        #   Splits the leaves into runs that are next to each other, a few for
+        #   every worker, so each of them maps the file only a few times.
+        runs = list()
+        run_length = max(1, -(-len(indices) // (4 * self.workers)))
+
+        for index in indices:
+            if len(runs) != 0 and runs[-1][1] == index and runs[-1][1] - runs[-1][0] < run_length:
+                runs[-1][1] += 1
+            else:
+                runs.append([index, index + 1])
+
+        jobs = [(self.hash_class, self.key_length, file_path, self.leaf_size, start, stop) for start, stop in runs]
+
+        #   On one core, or for a few leaves, the processes only slow it down.
+        workers = min(self.workers, os.cpu_count() or 1, len(runs))
+
+        if workers < 2 or len(indices) * self.leaf_size < min_parallel_length:
+            digests = [_hash_leaves(*job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                digests = list(executor.map(_hash_leaves, *zip(*jobs)))
+
+        return [digest for run in digests for digest in run]
+
+    def hash_file(self, file_path: str, chunk_size: int = None, memory_map: bool = True):
+        #   Hashes the leaves of the file in parallel, unless something's been
+        #   hashed already, which the file has to carry on from.
+        if len(self._leaves) != 0 or len(self._pending) != 0:
+            return super().hash_file(file_path, chunk_size=chunk_size, memory_map=memory_map)
+
+        return self.rehash_file(file_path)
+
+    def rehash_file(self, file_path: str, changed: List[Tuple[int, int]] = None):
+        #   Once a file has been hashed, hashes it again after the given ranges
+        #   (as offsets and lengths) of it changed, and its size did or didn't.
+        #   Only the leaves that have changed (or weren't there before) are
+        #   hashed again.
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File \"{file_path}\" doesn't exist!")
+
+        n_leaves = os.path.getsize(file_path) // self.leaf_size
+        dirty = set(range(min(len(self._leaves), n_leaves), n_leaves))
+
+        for offset, length in ([] if changed is None else changed):
+            if length > 0:
+                last = min((offset + length - 1) // self.leaf_size + 1, n_leaves)
+                dirty.update(range(offset // self.leaf_size, last))
+
+        leaves = self._leaves[:n_leaves] + [b""] * (n_leaves - len(self._leaves))
+        indices = sorted(dirty)
+
+        for index, digest in zip(indices, self._hash_file_leaves(file_path, indices)):
+            leaves[index] = digest
+
+        with open(file_path, mode="rb") as file:
+            file.seek(n_leaves * self.leaf_size)
+            self._pending = bytearray(file.read())
+
+        self._leaves = leaves
+
+        return self.hash.digest()
+
+
+class _Digest:
+    #   A digest that's already known, which can be signed (and verified) the
+    #   same as the hash object it came from, since that's all that's used.
+    def __init__(self, digest: bytes, oid: str):
+        self._digest = digest
+        self.oid = oid
+        self.digest_size = len(digest)
+
+    def digest(self):
+        return self._digest
+
+    def hexdigest(self):
+        return self._digest.hex()
+
+
+class DigestCache:
+    #   Remembers the digests of files, by their path, size, mtime, inode and
+    #   the hash they were hashed with, so a file that hasn't changed since is
+    #   never hashed again. The least recently used ones are forgotten once
+    #   there are more than the capacity. With a file path, the cache is kept
+    #   there and saved whenever there's a new digest in it (into a file next
+    #   to it that then replaces it, so it's never half written). Hits only
+    #   change which digests were used last, so that's saved along with the
+    #   next new digest, or once the cache is closed (or its with block ends).
+    #
+    #   Since mtimes aren't exact, a file whose mtime is too recent could still
+    #   change without its mtime changing, so it isn't cached until later (the
+    #   same problem, and solution, as git's "racily clean" files). Neither is
+    #   a file that changed while it was being hashed.
+
+    def __init__(self, file_path: str = None, capacity: int = None, racy_window: float = None):
+        self._file_path = file_path
+        self._capacity = 4096 if capacity is None else capacity
+        self._racy_window = 1. if racy_window is None else racy_window
+
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._dirty = False
+
+        if file_path is not None and os.path.exists(file_path):
+            self.load()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # region Properties
+    @property
+    def file_path(self):
+        return self._file_path
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    def __len__(self):
+        return len(self._entries)
+    # endregion
+
+    @staticmethod
+    def _get_key(file_path: str, status: os.stat_result, method_id: str, key_length: int):
+        return os.path.realpath(file_path), status.st_size, status.st_mtime_ns, status.st_ino, method_id, key_length
+
+    def hash_file(self, hash_instance: Hash, file_path: str):
+        #   Returns what hash_instance.hash would be once the file is hashed,
+        #   which it only is if its digest isn't in the cache.
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File \"{file_path}\" doesn't exist!")
+
+        status = os.stat(file_path)
+        key = self._get_key(file_path, status, hash_instance.method_id, hash_instance.key_length)
+        digest = self._entries.get(key, None)
+
+        if digest is not None:
+            if next(reversed(self._entries)) != key:
+                self._entries.move_to_end(key)
+                self._dirty = True
+
+            self._hits += 1
+
+            return _Digest(digest, hash_instance.hash.oid)
+
+        self._misses += 1
+
+        hash_instance.hash_file(file_path)
+        message_hash = hash_instance.hash
+
+        changed = self._get_key(file_path, os.stat(file_path), hash_instance.method_id, hash_instance.key_length) != key
+
+        if not changed and status.st_mtime_ns < time.time_ns() - int(self._racy_window * 1e9):
+            self._entries[key] = message_hash.digest()
+
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+            self.save()
+
+        return message_hash
+
+    def invalidate(self, file_path: str = None):
+        #   Forgets the digests of the file (of every version of it, and with
+        #   every hash), or of every file.
+        if file_path is None:
+            self._entries.clear()
+        else:
+            path = os.path.realpath(file_path)
+
+            for key in [key for key in self._entries if key[0] == path]:
+                del self._entries[key]
+
+        self.save()
+
+    def close(self):
+        if self._dirty:
+            self.save()
+
+    # region Serialization
+    def save(self):
+        self._dirty = False
+
+        if self.file_path is None:
+            return
+
+        chunks = [_index_header.pack(_index_magic, len(self._entries))]
+
+        for (path, size, mtime_ns, inode, method_id, key_length), digest in self._entries.items():
+            path, method_id = path.encode("utf8"), method_id.encode("utf8")
+            chunks.append(_index_entry.pack(size, mtime_ns, inode, key_length, len(path), len(method_id), len(digest)))
+            chunks.extend((path, method_id, digest))
+
+        temporary_path = f"{self.file_path}.{os.getpid()}.tmp"
+
+        with open(temporary_path, mode="wb") as file:
+            file.write(b"".join(chunks))
+
+        os.replace(temporary_path, self.file_path)
+
+    def load(self):
+        #   An index that can't be read is as good as an empty one.
+        with open(self.file_path, mode="rb") as file:
+            content = file.read()
+
+        self._entries.clear()
+
+        try:
+            magic, n_entries = _index_header.unpack_from(content)
+
+            if magic != _index_magic:
+                return
+
+            offset = _index_header.size
+
+            for _ in range(n_entries):
+                size, mtime_ns, inode, key_length, path_length, method_length, digest_length = \
+                    _index_entry.unpack_from(content, offset)
+                offset += _index_entry.size
+
+                path = content[offset:offset + path_length].decode("utf8")
+                method_id = content[offset + path_length:offset + path_length + method_length].decode("utf8")
+                offset += path_length + method_length
+
+                digest = content[offset:offset + digest_length]
+                offset += digest_length
+
+                if len(digest) != digest_length:
+                    raise ValueError("Index is cut short!")
+
+                self._entries[(path, size, mtime_ns, inode, method_id, key_length)] = digest
+        except (struct.error, UnicodeDecodeError, ValueError):
+            self._entries.clear()
+    # endregion